@@ -0,0 +1,175 @@
+# ========================================================
+#   Copyright (C) 2018 All rights reserved.
+#
+#   filename : async_server.py
+#   date     : 2026-10-18
+#   desc     : /getAudio 的异步（ASGI）版本，hypercorn async_server:app
+#              识别请求在事件循环中等待，不占用线程；
+#              纠正、切词、规则提取为CPU密集操作，放入线程池执行
+# ========================================================
+
+from quart import request, Quart, g
+import json, uuid, asyncio, hashlib
+from concurrent.futures import ThreadPoolExecutor
+from utils import *
+from utils.AsyncRecognizeTXY import AsyncCloudASR
+from utils.Exrsp import *
+from utils.Logger import logger
+from utils.Metrics import observe_request, export_metrics, register_cache
+from instance import *
+import sys
+import traceback
+
+
+app = Quart(__name__)
+
+
+@app.before_serving
+async def startup():
+    await asr_engine.start()
+
+
+@app.after_serving
+async def shutdown():
+    await asr_engine.close()
+    executor.shutdown(wait=False)
+
+
+# 记录耗时与返回码的接口
+METRIC_ENDPOINTS = {'getAudio'}
+
+
+@app.before_request
+async def start_timer():
+    g.timer = StageTimer()
+    g.situation = None
+    g.code = None  # 返回结果中的code，由接口设置，record_metrics 不再解析响应
+
+
+# 各阶段耗时记入 /metrics 直方图，并以 Server-Timing 响应头返回
+@app.after_request
+async def record_metrics(response):
+    if request.endpoint in METRIC_ENDPOINTS:
+        code = g.code if g.code is not None else 'http_{}'.format(response.status_code)
+        observe_request(request.endpoint, g.timer, g.situation, code)
+        response.headers['Server-Timing'] = g.timer.server_timing()
+    return response
+
+
+@app.route('/getAudio', methods=['POST'])
+async def getAudio():
+    timer = g.timer
+    ip = request.remote_addr
+    src = "GetAudio"
+    with timer.stage('upload'):
+        formData = await request.form
+        files = await request.files
+    f = files['file']
+    upfilename = f.filename
+    datas = formData
+    try:
+
+        openid = formData["userid"]
+        situation = formData["situation"]
+        g.situation = situation
+        logger.debug("[Request Log] ip:{} src:{} openid:{} data:{}".format(ip, src, openid, str(datas)).replace("\n","").replace("\r", ""))
+
+        random_name = str(uuid.uuid1())
+        audio_mp3 = openid + "@" + random_name + ".mp3"
+        logger.debug(
+            "[Request Log] ip:{} src:{} filename:{} data:{}".format(ip, src, audio_mp3, str(datas)).replace("\n","").replace("\r", ""))
+
+        # 重复上传的同一段音频直接返回之前的结果，不再调用识别
+        # 键中带处理流程的重载次数，字典重载后不再使用旧结果
+        with timer.stage('upload'):
+            data = f.read()
+        with timer.stage('cache'):
+            cache_key = (hashlib.sha256(data).hexdigest(), situation, pipeline.reloads)
+            cached = audio_cache.get(cache_key)
+        if cached is not None:
+            response, g.code = cached
+            logger.debug("[Response Log] cached {}".format(response))
+            return response
+
+        # 语音接口
+        with timer.stage('asr'):
+            info = await asr_engine.stt_data(data)
+
+        # 拼音纠正、切词、修正结果
+        with timer.stage('pipeline'):
+            resSets = await asyncio.get_running_loop().run_in_executor(
+                executor, lambda: pipeline.get().run(info, situation, timer))
+
+        with timer.stage('encode'):
+            response = json.dumps(resSets, ensure_ascii=False)
+        g.code = resSets['code']
+        audio_cache.put(cache_key, (response, g.code))
+        logger.debug("[Response Log] {}".format(response))
+        return response
+
+    # 语音识别API出现问题（包括超时）
+    except ASRServerError as e:
+        logger.error("[AudioServer Error] Msg: {} Code: {}".format(e.message, e.status))
+        resSets = AudioServerErr()
+        g.code = resSets['code']
+        return json.dumps(resSets, ensure_ascii=False)
+    # 模型、索引尚未加载完成
+    except EngineNotReadyError as e:
+        logger.error(str(e))
+        resSets = AudioServerErr()
+        g.code = resSets['code']
+        return json.dumps(resSets, ensure_ascii=False)
+    except:
+        exc_type, exc_value, exc_traceback = sys.exc_info()
+        logger.error("[UnknownAudioError] upfilename: {}".format(upfilename))
+        resSets = UnknownAudioError(ip, src, datas, "\t".join(traceback.format_exception(exc_type, exc_value, exc_traceback)).replace("\n","").replace("\r", ""))
+        g.code = resSets['code']
+        return json.dumps(resSets)
+
+
+# 存活检查，进程能响应即返回
+@app.route('/healthz', methods=['GET'])
+async def healthz():
+    return json.dumps({'code': 0, 'status': 'alive'})
+
+
+# Prometheus 指标
+@app.route('/metrics', methods=['GET'])
+async def metrics():
+    body, content_type = export_metrics()
+    return body, 200, {'Content-Type': content_type}
+
+
+# 就绪检查，切词模型与纠错索引全部加载完成后返回200，否则返回503
+@app.route('/readyz', methods=['GET'])
+async def readyz():
+    ready, resSets = engines_status(engines)
+    return json.dumps(resSets), 200 if ready else 503
+
+
+# 重新加载字典：后台构建新的Rule、ASR_Corrector，完成后替换，期间请求使用旧版本
+@app.route('/admin/reload', methods=['POST'])
+async def adminReload():
+    if request.remote_addr not in ADMIN_IPS:
+        return json.dumps({'code': 403, 'msg': 'Permission denied!'}), 403
+
+    # 本worker立即重载，其他worker由重载标记通知
+    reloading = dict_watcher.reload_all()
+    logger.info("[Admin] reload {}".format(reloading))
+    return json.dumps({'code': 0, 'reloading': reloading})
+
+
+asr_engine = AsyncCloudASR(CLOUD_URL, CLOUD_APPID, CLOUD_SECRET, scheme=CLOUD_SCHEME)
+# 切词模型、纠错索引在后台线程中加载，端口先行监听，/readyz 返回加载状态
+# 纠错、切词、规则提取，PIPELINE_PROCESSES>0时在预加载的子进程中执行
+pipeline = LazyEngine('pipeline', build_pipeline).start()
+engines = [pipeline]
+dict_watcher = DictWatcher(engines).start()
+audio_cache = TTLCache(AUDIO_CACHE_SIZE, AUDIO_CACHE_TTL)
+# 缓存统计由 /metrics 导出，处理流程加载完成前不导出其结果缓存
+register_cache('audio', audio_cache.stats)
+register_cache('pipeline_memo', lambda: pipeline.get().cache_stats() if pipeline.ready else None)
+executor = ThreadPoolExecutor(max_workers=ASYNC_CPU_WORKERS)
+
+if __name__ == "__main__":
+    app.run(host="0.0.0.0", port=PORT, debug=False)
@@ -0,0 +1,298 @@
+# ========================================================
+#   Copyright (C) 2018 All rights reserved.
+#
+#   filename : bench_corrector.py
+#   date     : 2026-10-18
+#   desc     : 拼音纠错性能测试，替代 Modify.py 中的 test()
+#              语料由 hf_dict_utf8.txt（药物）与 dict_stat.txt 生成，按纠错等级、字典大小统计
+#              索引构建时间、峰值内存、各版本（v0/v1/v2/batch）单条延迟p50/p99与吞吐，结果保存为JSON
+#
+#              python benchmarks/bench_corrector.py -o bench.json
+#              python benchmarks/bench_corrector.py -o new.json --compare bench.json
+#              python benchmarks/bench_corrector.py --check    # batch与单条结果一致性检查，不一致时返回1
+# ========================================================
+
+import os, sys, json, time, random, argparse, platform, tracemalloc
+
+# for import purpose
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+import numpy as np
+from pypinyin import lazy_pinyin
+
+from instance import *
+# utils 包会导入切词模型，这里只需要纠错模块
+sys.path.insert(0, os.path.join(ROOT, 'utils'))
+from Modify import ASR_Corrector, ASR_Corrector_FuzzyLevel
+
+
+# 测试使用的纠错等级
+FUZZY_LEVELS = {'normal': ASR_Corrector_FuzzyLevel.Normal,
+                'fuzzy': ASR_Corrector_FuzzyLevel.MoreFuzzy,
+                'strict': ASR_Corrector_FuzzyLevel.MoreStrict}
+
+# 各字典生成语料的句式
+MED_TEMPLATES = ['我今天吃了{}一片', '{}两粒', '早上吃了{}，晚上吃了{}', '刚才吃了半片{}', '{}', '医生让我吃{}一天三次']
+STAT_TEMPLATES = ['{}一百二{}八十', '{}七十五', '今天{}六十五', '{}{}', '我的{}是一百三十']
+
+# 替换成同音字的比例，模拟识别错误
+NOISE_RATIO = 0.25
+
+# 一致性检查总是包含的文本，分数、长度相同的重叠匹配曾在batch与单条中选出不同词条
+CHECK_TEXTS = ['今8体2', '我吃了768一片六施', '我的九今是一百三十', '早上吃了他客莫斯，晚上吃了埃格', '早上吃了畅苏，晚上吃了福方马来酸依那普利']
+
+
+# 字典词条：药物名称、统计字典词条
+def load_names(dict_name):
+    if dict_name == 'med':
+        with open(os.path.join(ROOT, DICT_MED), mode='r', encoding='utf-8') as dict_f:
+            return [s[0] for s in (line.strip().split('\t') for line in dict_f) if len(s) > 1 and s[1] == '药物']
+
+    with open(os.path.join(ROOT, DICT_STAT), mode='r', encoding='utf-8') as dict_f:
+        return [line.rstrip('\n') for line in dict_f if len(line.strip()) >= 2]
+
+
+# 指定大小的字典，超过原字典大小时用两个词条的前后半拼接出新词条
+def make_dict(names, size, rng):
+    if size <= len(names):
+        return rng.sample(names, size)
+
+    items = list(names)
+    seen = set(items)
+    while len(items) < size:
+        a, b = rng.choice(names), rng.choice(names)
+        item = a[:max(1, len(a) // 2)] + b[len(b) // 2:]
+        if len(item) >= 2 and item not in seen:
+            seen.add(item)
+            items.append(item)
+
+    return items
+
+
+# 按拼音分组的常用字，用于生成同音字错误
+def build_homophones(names):
+    homophones = {}
+    for ch in set(''.join(names)) | set('我今天吃了一片两粒早上晚医生让三次刚才半的是百十七八五六'):
+        homophones.setdefault(lazy_pinyin(ch)[0], []).append(ch)
+
+    return homophones
+
+
+def add_noise(item, homophones, rng):
+    chars = []
+    for ch in item:
+        candidates = homophones.get(lazy_pinyin(ch)[0], [])
+        if len(candidates) > 1 and rng.random() < NOISE_RATIO:
+            ch = rng.choice([c for c in candidates if c != ch])
+        chars.append(ch)
+
+    return ''.join(chars)
+
+
+# 合成语料：句式中填入加噪的词条，部分句子不含词条
+def make_corpus(items, dict_name, size, rng):
+    templates = MED_TEMPLATES if dict_name == 'med' else STAT_TEMPLATES
+    homophones = build_homophones(items)
+
+    corpus = []
+    for _ in range(size):
+        template = rng.choice(templates)
+        if rng.random() < 0.1:
+            corpus.append(template.replace('{}', ''))
+        else:
+            fills = [add_noise(rng.choice(items), homophones, rng) for _ in range(template.count('{}'))]
+            corpus.append(template.format(*fills))
+
+    return corpus
+
+
+def build_corrector(fuzzy_level, items):
+    return ASR_Corrector(fuzzy_level=fuzzy_level, hf_dict=None, rep_rule=os.path.join(ROOT, DICT_PRE_RULE), filter_dict=None,
+                         custom_dict=None, extra_dict=items, index_cache=None)
+
+
+# 冷启动构建索引的时间，峰值内存单独构建一次测量，tracemalloc会拖慢构建
+def bench_build(fuzzy_level, items):
+    start = time.perf_counter()
+    corrector = build_corrector(fuzzy_level, items)
+    build_ms = (time.perf_counter() - start) * 1000
+
+    tracemalloc.start()
+    build_corrector(fuzzy_level, items)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return corrector, {'build_ms': build_ms, 'build_peak_mb': peak / 1024 / 1024}
+
+
+# 单条延迟与吞吐，batch按整批计时，只有平均值，没有测得的分位数（p50、p99为None）
+def bench_engine(corrector, engine, corpus):
+    if engine == 'batch':
+        start = time.perf_counter()
+        corrector.asr_correct_batch(corpus)
+        total = time.perf_counter() - start
+        return {'mean_ms': total / len(corpus) * 1000,
+                'p50_ms': None,
+                'p99_ms': None,
+                'throughput': len(corpus) / total if total > 0 else float('inf'),
+                'errors': 0}
+    else:
+        correct = {'v0': corrector.asr_correct_text_v0,
+                   'v1': corrector.asr_correct_text_v1,
+                   'v2': corrector.asr_correct_text}[engine]
+        # v1 在拼音数少于字数的词条（如字母、数字）上会越界，记录出错条数
+        latencies, errors = [], 0
+        for text in corpus:
+            start = time.perf_counter()
+            try:
+                correct(text)
+            except IndexError:
+                errors += 1
+            latencies.append((time.perf_counter() - start) * 1000)
+        latencies = np.array(latencies)
+        total = latencies.sum() / 1000
+
+    return {'mean_ms': float(latencies.mean()),
+            'p50_ms': float(np.percentile(latencies, 50)),
+            'p99_ms': float(np.percentile(latencies, 99)),
+            'throughput': len(corpus) / total if total > 0 else float('inf'),
+            'errors': errors}
+
+
+# asr_correct_batch 与逐条 asr_correct_text 结果（纠正文本、匹配列表）不同的文本
+def check_batch(corrector, corpus):
+    batch = corrector.asr_correct_batch(corpus)
+    mismatches = []
+    for text, (corr, matches) in zip(corpus, batch):
+        single_corr, single_matches = corrector.asr_correct_text(text)
+        if (corr, matches) != (single_corr, list(single_matches)):
+            mismatches.append((text, (single_corr, single_matches), (corr, matches)))
+
+    return mismatches
+
+
+# 各字典、纠错等级下检查batch结果，统计字典按线上方式加载（DICT_STAT作为自定义字典）
+def run_check(args):
+    rng = random.Random(args.seed)
+    total = 0
+
+    for dict_name in args.dicts:
+        names = load_names(dict_name)
+        for size in args.sizes or [len(names)]:
+            items = make_dict(names, size, rng)
+            corpus = make_corpus(items, dict_name, args.corpus, rng) + CHECK_TEXTS
+
+            for level in args.levels:
+                if dict_name == 'stat' and not args.sizes:
+                    corrector = ASR_Corrector(fuzzy_level=FUZZY_LEVELS[level], hf_dict=None,
+                                              rep_rule=os.path.join(ROOT, DICT_PRE_RULE), filter_dict=None,
+                                              custom_dict=os.path.join(ROOT, DICT_STAT), index_cache=None)
+                else:
+                    corrector = build_corrector(FUZZY_LEVELS[level], items)
+
+                mismatches = check_batch(corrector, corpus)
+                total += len(mismatches)
+                print("{:<5} {:>6} {:<7} texts {:>6}  mismatches {}".format(dict_name, size, level, len(corpus),
+                                                                            len(mismatches)))
+                for text, single, batch in mismatches[:5]:
+                    print("    {}  single {}  batch {}".format(text, single, batch))
+
+    return total
+
+
+def run(args):
+    rng = random.Random(args.seed)
+    results = []
+
+    for dict_name in args.dicts:
+        names = load_names(dict_name)
+        sizes = args.sizes or [len(names)]
+
+        for size in sizes:
+            items = make_dict(names, size, rng)
+            corpus = make_corpus(items, dict_name, args.corpus, rng)
+
+            for level in args.levels:
+                corrector, build = bench_build(FUZZY_LEVELS[level], items)
+
+                for engine in args.engines:
+                    # v0逐个词条比较，语料只取一部分
+                    texts = corpus[:max(1, len(corpus) // 10)] if engine == 'v0' else corpus
+                    corrector.asr_correct_text(texts[0])  # warm up
+
+                    result = {'dict': dict_name, 'dict_size': size, 'level': level, 'engine': engine,
+                              'texts': len(texts)}
+                    result.update(build)
+                    result.update(bench_engine(corrector, engine, texts))
+                    if engine == 'batch':
+                        result['mismatches'] = len(check_batch(corrector, texts))
+                    results.append(result)
+
+                    print("{dict:<5} {dict_size:>6} {level:<7} {engine:<6} build {build_ms:>9.1f}ms "
+                          "{build_peak_mb:>7.1f}MB  mean {mean_ms:>8.3f}ms  p50 {p50:>10}  p99 {p99:>10}  "
+                          "{throughput:>10.1f}/s  errors {errors}".format(p50=format_ms(result['p50_ms']),
+                                                                          p99=format_ms(result['p99_ms']),
+                                                                          **result) +
+                          ("  mismatches {}".format(result['mismatches']) if engine == 'batch' else ''))
+
+    return {'time': time.strftime("%Y-%m-%d %H:%M:%S"),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'seed': args.seed,
+            'corpus': args.corpus,
+            'results': results}
+
+
+# 没有测得的值（batch的分位数）显示为 -
+def format_ms(value):
+    return '-' if value is None else "{:.3f}ms".format(value)
+
+
+# 与之前保存的结果对比，>1 表示变慢
+def compare(report, baseline):
+    base_map = {(r['dict'], r['dict_size'], r['level'], r['engine']): r for r in baseline['results']}
+
+    print()
+    print('ratio to baseline (new / old)')
+    for r in report['results']:
+        old = base_map.get((r['dict'], r['dict_size'], r['level'], r['engine']))
+        if old is None:
+            continue
+
+        ratios = {k: r[k] / old[k] if r.get(k) is not None and old.get(k) else float('nan')
+                  for k in ('build_ms', 'build_peak_mb', 'mean_ms', 'p50_ms', 'p99_ms')}
+        ratios['throughput'] = old['throughput'] / r['throughput'] if r['throughput'] else float('nan')
+        print("{:<5} {:>6} {:<7} {:<6} ".format(r['dict'], r['dict_size'], r['level'], r['engine']) +
+              '  '.join("{} {:.2f}".format(k, v) for k, v in ratios.items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark of ASR_Corrector')
+    parser.add_argument('-o', '--output', default='bench_corrector.json', help='result json file')
+    parser.add_argument('--compare', help='baseline result json file')
+    parser.add_argument('--dicts', nargs='+', default=['med', 'stat'], choices=['med', 'stat'])
+    parser.add_argument('--sizes', nargs='+', type=int, help='dict sizes, default the full dict')
+    parser.add_argument('--levels', nargs='+', default=list(FUZZY_LEVELS), choices=list(FUZZY_LEVELS))
+    parser.add_argument('--engines', nargs='+', default=['v0', 'v1', 'v2', 'batch'],
+                        choices=['v0', 'v1', 'v2', 'batch'])
+    parser.add_argument('--corpus', type=int, default=2000, help='number of texts per dict size')
+    parser.add_argument('--seed', type=int, default=2018)
+    parser.add_argument('--check', action='store_true', help='only check batch results against single text ones')
+    args = parser.parse_args()
+
+    if args.check:
+        sys.exit(1 if run_check(args) else 0)
+
+    report = run(args)
+    with open(args.output, mode='w', encoding='utf-8') as out_f:
+        json.dump(report, out_f, ensure_ascii=False, indent=2)
+    print("saved to {}".format(args.output))
+
+    if args.compare:
+        with open(args.compare, mode='r', encoding='utf-8') as base_f:
+            compare(report, json.load(base_f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+# ========================================================
+#   Copyright (C) 2018 All rights reserved.
+#
+#   filename : gunicorn.conf.py
+#   date     : 2020-10-12
+#   desc     : 多进程部署配置  gunicorn -c gunicorn.conf.py online_server:app
+#              主进程加载切词模型与改错索引后再fork，worker之间共享只读索引，
+#              改错索引尾表为内存映射文件（INDEX_SHARED），不随worker数量增加内存
+# ========================================================
+
+import gc
+import os
+import multiprocessing
+
+from instance.Variable import PORT
+
+bind = "0.0.0.0:{}".format(PORT)
+workers = int(os.environ.get("WORKERS", multiprocessing.cpu_count()))
+
+# online_server在主进程中导入，Rule、ASR_Corrector只构建一次
+preload_app = True
+
+
+def pre_fork(server, worker):
+    # 模型、索引在主进程的后台线程中加载，线程不会随fork进入worker，
+    # 加载完成后再fork，worker直接继承已加载的对象
+    import online_server
+    for engine in online_server.engines:
+        engine.wait()
+
+    # 主进程已加载的对象不再参与gc，worker中的gc不会写这些对象所在内存页，避免写时复制
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    # 字典检查线程不随fork进入worker，在每个worker中重新启动
+    import online_server
+    online_server.dict_watcher.start()
+
+
+def child_exit(server, worker):
+    # 多进程指标（PROMETHEUS_MULTIPROC_DIR）中清理已退出worker的数据
+    from utils.Metrics import mark_process_dead
+    mark_process_dead(worker.pid)
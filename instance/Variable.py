@@ -12,6 +12,8 @@
 
 # 端口
 PORT = 8088
+# 上传音频超过该大小（字节）时才写入临时文件，否则只保存在内存中
+UPLOAD_SPOOL_SIZE = 2 * 1024 * 1024
 
 
 #    --------------------   字典
@@ -31,6 +33,70 @@ DICT_CUSTOM = './dict/dict_custom.txt'
 DICT_FILTER_RULE = './dict/dict_filter_rule.txt'
 # 记录改错字典
 DICT_STAT = './dict/dict_stat.txt'
+# 改错索引缓存目录，None则每次启动重建索引
+INDEX_CACHE_DIR = './dict/index_cache'
+# 保留最近保存或加载过的改错索引个数，字典、阈值修改前的旧索引在保存新索引后删除
+INDEX_CACHE_KEEP = 4
+# 改错索引以只读内存映射方式加载，多进程部署时各worker共享同一份物理内存
+INDEX_SHARED = True
+# 改错拼音缓存大小（常用字以外的词数）
+PY_CACHE_SIZE = 50000
+# 改错非标准拼音（数字、字母等）相似度缓存大小
+ODD_SCORE_CACHE_SIZE = 20000
+
+# -------------------------------
+# 腾讯云语音识别
+# 地域
+CLOUD_REGION = 'ap-chengdu'
+# 每个进程复用的客户端（长连接）数量
+CLOUD_POOL_SIZE = 8
+# 是否保持长连接
+CLOUD_KEEP_ALIVE = True
+# 单次识别超时（秒）
+CLOUD_TIMEOUT = 60
+# 协议，本地压测时设为'http'，CLOUD_URL指向 tools/fake_asr_server.py
+CLOUD_SCHEME = 'https'
+
+# 异步服务（async_server.py）
+# 同时进行的识别请求上限
+ASYNC_ASR_CONCURRENCY = 200
+# 单个识别请求超时（秒），包括排队时间
+ASYNC_ASR_TIMEOUT = 15
+# 纠正、切词、规则提取线程数
+ASYNC_CPU_WORKERS = 4
+
+# 相同音频（按内容哈希+situation）重复上传时直接返回缓存结果
+# 缓存条数
+AUDIO_CACHE_SIZE = 10000
+# 缓存有效期（秒）
+AUDIO_CACHE_TTL = 600
+# 识别文本处理结果缓存条数（按文本+situation+字典版本）
+TEXT_MEMO_SIZE = 50000
+
+# 批量切词进程数，1表示在当前进程内切词
+SEG_PROCESSES = 1
+# 批量切词时去重后句子数达到该值才使用进程池
+SEG_PARALLEL_MIN = 64
+
+# 纠错+切词+规则提取的子进程数，0表示在请求线程中执行；
+# gunicorn多worker部署时本身已是多进程，保持为0
+PIPELINE_PROCESSES = 0
+# 单条文本在子进程中处理的超时时间（秒）
+PIPELINE_TIMEOUT = 10
+# 子进程构建处理流程（首次启动时包括构建改错索引）的超时时间（秒）
+PIPELINE_START_TIMEOUT = 600
+# 模型、索引后台加载期间，请求最多等待的时间（秒）
+ENGINE_WAIT_TIMEOUT = 30
+# 检查字典文件是否变化的间隔（秒），0表示不检查，只能通过 /admin/reload 重载
+RELOAD_INTERVAL = 0
+# /admin/reload 写入新的重载标记，各worker定期检查，标记变化后各自重载（gunicorn多worker时全部重载）
+RELOAD_FILE = './dict/index_cache/reload_request'
+# 检查重载标记的间隔（秒）
+RELOAD_POLL_INTERVAL = 2
+# 重载后旧对象（进程池）延迟关闭的时间（秒）
+RELOAD_GRACE = 60
+# 允许调用 /admin/reload 的地址
+ADMIN_IPS = ['127.0.0.1']
 
 # -------------------------------
 # 语音相关
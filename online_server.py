@@ -8,9 +8,10 @@
 #   desc     :
 # ========================================================
 
-from flask import request, Flask
-import requests, json, os, uuid
+from flask import request, Flask, Request, g
+import requests, json, os, uuid, tempfile, hashlib
 from utils import *
+from utils.Metrics import observe_request, export_metrics, register_cache
 from instance import *
 import pkuseg
 import time
@@ -22,57 +23,84 @@ import traceback
 #  工程接口
 # ----------------------------------------------------------------------------------------------------------------------
 
+class UploadRequest(Request):
+    # 上传文件小于UPLOAD_SPOOL_SIZE时保存在内存中，超过时写入自动删除的临时文件，不再写入tmp/
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_SIZE, mode='rb+')
+
+
 app = Flask(__name__)
+app.request_class = UploadRequest
+
+# 记录耗时与返回码的接口
+METRIC_ENDPOINTS = {'getAudio', 'getRawAudio', 'getCorrection', 'getStructured'}
+
+
+@app.before_request
+def start_timer():
+    g.timer = StageTimer()
+    g.situation = None
+    g.code = None  # 返回结果中的code，由接口设置，record_metrics 不再解析响应
+
+
+# 各阶段耗时记入 /metrics 直方图，并以 Server-Timing 响应头返回
+@app.after_request
+def record_metrics(response):
+    if request.endpoint in METRIC_ENDPOINTS:
+        code = g.code if g.code is not None else 'http_{}'.format(response.status_code)
+        observe_request(request.endpoint, g.timer, g.situation, code)
+        response.headers['Server-Timing'] = g.timer.server_timing()
+    return response
+
 
 @app.route('/getAudio', methods=['POST'])
 def getAudio():
+    timer = g.timer
     ip = request.remote_addr
     src = "GetAudio"
-    formData = request.form
-    f = request.files['file']
+    with timer.stage('upload'):
+        formData = request.form
+        f = request.files['file']
     upfilename = f.filename
     datas = formData
     try:
 
         openid = formData["userid"]
         situation = formData["situation"]
+        g.situation = situation
         logger.debug("[Request Log] ip:{} src:{} openid:{} data:{}".format(ip, src, openid, str(datas)).replace("\n","").replace("\r", ""))
 
-        basepath = os.path.dirname(__file__)  # 当前文件所在路径
         createTime = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(int(time.time())))
 
-        # 语音接口
+        # 语音接口，上传数据只读取一次，直接交给识别引擎
         random_name = str(uuid.uuid1())
-        audio_mp3, audio_wav = openid + "@" + random_name + ".mp3", openid + "@" + random_name + ".wav"
+        audio_mp3 = openid + "@" + random_name + ".mp3"
         logger.debug(
             "[Request Log] ip:{} src:{} filename:{} data:{}".format(ip, src, audio_mp3, str(datas)).replace("\n","").replace("\r", ""))
-        upload_path = os.path.join(basepath, 'tmp/')
-
-        if os.path.exists(upload_path) == False:
-            os.makedirs(upload_path)
-        f.save(upload_path + audio_mp3)
-
-
-        info = asr_engine.stt(upload_path + audio_mp3)
-
-        # 拼音纠正
-        if situation != '3':
-            corr, _ = asr_corrector_stat.asr_correct_text(info)
-        else:
-            corr = info
-
-        # 切词
-        text = rule.WordSeg(corr)
 
-        # 修正结果
-        resSets = rule.JudgeType(text, situation)
-
-        resSets.update({"txt": info,
-                        "corr": corr,
-                        "seg": ' '.join(text)
-                        })
-
-        response = json.dumps(resSets, ensure_ascii=False)
+        # 重复上传的同一段音频直接返回之前的结果，不再调用识别
+        # 键中带处理流程的重载次数，字典重载后不再使用旧结果
+        with timer.stage('upload'):
+            data = f.read()
+        with timer.stage('cache'):
+            cache_key = (hashlib.sha256(data).hexdigest(), situation, pipeline.reloads)
+            cached = audio_cache.get(cache_key)
+        if cached is not None:
+            response, g.code = cached
+            logger.debug("[Response Log] cached {}".format(response))
+            return response
+
+        with timer.stage('asr'):
+            info = asr_engine.stt_data(data)
+
+        # 拼音纠正、切词、修正结果
+        with timer.stage('pipeline'):
+            resSets = pipeline.get().run(info, situation, timer)
+
+        with timer.stage('encode'):
+            response = json.dumps(resSets, ensure_ascii=False)
+        g.code = resSets['code']
+        audio_cache.put(cache_key, (response, g.code))
         logger.debug("[Response Log] {}".format(response))
         return response
 
@@ -80,47 +108,56 @@ def getAudio():
     # add by jiangjiacheng
     except ASRServerError as e:
         logger.error("[AudioServer Error] Msg: {} Code: {}".format(e.message, e.status))
-        return json.dumps(AudioServerErr(), ensure_ascii=False)
+        resSets = AudioServerErr()
+        g.code = resSets['code']
+        return json.dumps(resSets, ensure_ascii=False)
+    # 模型、索引尚未加载完成
+    except EngineNotReadyError as e:
+        logger.error(str(e))
+        resSets = AudioServerErr()
+        g.code = resSets['code']
+        return json.dumps(resSets, ensure_ascii=False)
     except:
         exc_type, exc_value, exc_traceback = sys.exc_info()
         logger.error("[UnknownAudioError] upfilename: {}".format(upfilename))
         resSets = UnknownAudioError(ip, src, datas, "\t".join(traceback.format_exception(exc_type, exc_value, exc_traceback)).replace("\n","").replace("\r", ""))
+        g.code = resSets['code']
         return json.dumps(resSets)
 
 
 @app.route('/getRawAudio', methods=['POST'])
 def getRawAudio():
+    timer = g.timer
     ip = request.remote_addr
     src = "GetRawAudio"
-    formData = request.form
-    f = request.files['file']
+    with timer.stage('upload'):
+        formData = request.form
+        f = request.files['file']
     upfilename = f.filename
     datas = formData
     try:
 
         openid = formData["userid"]
         logger.debug("[Request Log] ip:{} src:{} openid:{}".format(ip, src, openid).replace("\n", "").replace("\r", ""))
-        basepath = os.path.dirname(__file__)  # 当前文件所在路径
         createTime = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(int(time.time())))
 
-        # 语音接口
+        # 语音接口，上传数据只读取一次，直接交给识别引擎
         random_name = str(uuid.uuid1())
-        audio_mp3, audio_wav = openid + "@" + random_name + ".mp3", openid + "@" + random_name + ".wav"
+        audio_mp3 = openid + "@" + random_name + ".mp3"
         logger.debug(
             "[Request Log] ip:{} src:{} filename:{} data:{}".format(ip, src, audio_mp3, str(datas)).replace("\n","").replace("\r", ""))
 
-        upload_path = os.path.join(basepath, 'tmp/')
-        if os.path.exists(upload_path) == False:
-            os.makedirs(upload_path)
-        f.save(upload_path + audio_mp3)
-
-        info = asr_engine.stt(upload_path + audio_mp3)
+        with timer.stage('upload'):
+            data = f.read()
+        with timer.stage('asr'):
+            info = asr_engine.stt_data(data)
 
         resSets = {'code': 0,
                    'txt': info
                    }
 
         logger.info(resSets)
+        g.code = resSets['code']
         return json.dumps(resSets, ensure_ascii=False)
 
 
@@ -128,12 +165,15 @@ def getRawAudio():
     # add by jiangjiacheng
     except ASRServerError as e:
         logger.warning("[AudioServer Error] Msg: {} Code: {}".format(e.message, e.status))
-        return json.dumps(AudioServerErr(), ensure_ascii=False)
+        resSets = AudioServerErr()
+        g.code = resSets['code']
+        return json.dumps(resSets, ensure_ascii=False)
 
     except:
         exc_type, exc_value, exc_traceback = sys.exc_info()
         logger.error("[UnknownAudioError] upfilename: {}".format(upfilename))
         resSets = UnknownAudioError(ip, src, datas, "\t".join(traceback.format_exception(exc_type, exc_value, exc_traceback)).replace("\n","").replace("\r", ""))
+        g.code = resSets['code']
         return json.dumps(resSets)
 
 
@@ -148,12 +188,52 @@ def getCorrection():
         info = datas['txt']
 
         # 拼音纠正
-        corr, _ = asr_corrector.asr_correct_text(info)
+        with g.timer.stage('correct'):
+            corr, _ = asr_corrector.get().asr_correct_text(info)
 
         resSets = {'code': 0,
                    'corr': corr
                    }
-        response = json.dumps(resSets, ensure_ascii=False)
+        with g.timer.stage('encode'):
+            response = json.dumps(resSets, ensure_ascii=False)
+        g.code = resSets['code']
+        logger.debug("[Response Log] {}".format(response))
+        return response
+
+    # general exception
+    except Exception as e:
+        exc_type, exc_value, exc_traceback = sys.exc_info()
+        resSets = UnknownAudioError(ip, src, datas, "\t".join(traceback.format_exception(exc_type, exc_value,exc_traceback)).replace("\n","").replace("\r", ""))
+        g.code = resSets['code']
+        return json.dumps(resSets)
+
+
+@app.route('/getStructured', methods=['POST'])
+def getStructured():
+    src = "getStructured"
+    datas, ip = request.json, request.remote_addr
+    try:
+
+        logger.debug("[Request Log] ip:{} src:{} datas:{}".format(ip, src, datas).replace("\n", "").replace("\r", ""))
+
+        # 单条：{"txt": "...", "situation": "1"}
+        # 批量：{"items": [{"txt": "...", "situation": "1"}, ...]}，结果顺序与items一致
+        if 'items' in datas:
+            items = [(item['txt'], str(item['situation'])) for item in datas['items']]
+            g.situation = 'batch'
+
+            with g.timer.stage('pipeline'):
+                resSets = {'code': 0,
+                           'results': pipeline.get().run_batch(items)
+                           }
+        else:
+            g.situation = str(datas['situation'])
+            with g.timer.stage('pipeline'):
+                resSets = pipeline.get().run(datas['txt'], g.situation, g.timer)
+
+        with g.timer.stage('encode'):
+            response = json.dumps(resSets, ensure_ascii=False)
+        g.code = resSets['code']
         logger.debug("[Response Log] {}".format(response))
         return response
 
@@ -161,13 +241,53 @@ def getCorrection():
     except Exception as e:
         exc_type, exc_value, exc_traceback = sys.exc_info()
         resSets = UnknownAudioError(ip, src, datas, "\t".join(traceback.format_exception(exc_type, exc_value,exc_traceback)).replace("\n","").replace("\r", ""))
+        g.code = resSets['code']
         return json.dumps(resSets)
 
 
-rule = Rule()
-asr_engine = BasicCloudASR(CLOUD_URL, CLOUD_APPID, CLOUD_SECRET)
-asr_corrector = ASR_Corrector()
-asr_corrector_stat = ASR_Corrector(fuzzy_level=ASR_Corrector_FuzzyLevel.MoreStrict, hf_dict=None, rep_rule=DICT_PRE_RULE,filter_dict=None, custom_dict=DICT_STAT)
+# 存活检查，进程能响应即返回
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    return json.dumps({'code': 0, 'status': 'alive'})
+
+
+# 就绪检查，切词模型与纠错索引全部加载完成后返回200，否则返回503
+@app.route('/readyz', methods=['GET'])
+def readyz():
+    ready, resSets = engines_status(engines)
+    return json.dumps(resSets), 200 if ready else 503
+
+
+# Prometheus 指标
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    body, content_type = export_metrics()
+    return body, 200, {'Content-Type': content_type}
+
+
+# 重新加载字典：后台构建新的Rule、ASR_Corrector，完成后替换，期间请求使用旧版本
+@app.route('/admin/reload', methods=['POST'])
+def adminReload():
+    if request.remote_addr not in ADMIN_IPS:
+        return json.dumps({'code': 403, 'msg': 'Permission denied!'}), 403
+
+    # 本worker立即重载，其他worker由重载标记通知
+    reloading = dict_watcher.reload_all()
+    logger.info("[Admin] reload {}".format(reloading))
+    return json.dumps({'code': 0, 'reloading': reloading})
+
+
+asr_engine = BasicCloudASR(CLOUD_URL, CLOUD_APPID, CLOUD_SECRET, scheme=CLOUD_SCHEME)
+# 切词模型、纠错索引在后台线程中加载，端口先行监听，/readyz 返回加载状态
+asr_corrector = LazyEngine('asr_corrector', ASR_Corrector).start()
+# 纠错、切词、规则提取，PIPELINE_PROCESSES>0时在预加载的子进程中执行
+pipeline = LazyEngine('pipeline', build_pipeline).start()
+engines = [asr_corrector, pipeline]
+dict_watcher = DictWatcher(engines).start()
+audio_cache = TTLCache(AUDIO_CACHE_SIZE, AUDIO_CACHE_TTL)
+# 缓存统计由 /metrics 导出，处理流程加载完成前不导出其结果缓存
+register_cache('audio', audio_cache.stats)
+register_cache('pipeline_memo', lambda: pipeline.get().cache_stats() if pipeline.ready else None)
 
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=PORT, debug=False)
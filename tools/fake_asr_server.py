@@ -0,0 +1,104 @@
+# ========================================================
+#   Copyright (C) 2018 All rights reserved.
+#
+#   filename : fake_asr_server.py
+#   date     : 2026-10-18
+#   desc     : 本地模拟腾讯云一句话识别（SentenceRecognition）接口，用于离线压测
+#              延迟、错误率可配置，识别结果从预置文本中按音频内容选取（同一段音频结果相同）
+#
+#              python tools/fake_asr_server.py --port 9000 --latency 300 --jitter 100 --error-rate 0.01
+#              instance/Variable.py 中设置 CLOUD_URL = '127.0.0.1:9000'，CLOUD_SCHEME = 'http'
+# ========================================================
+
+import json, time, uuid, base64, random, hashlib, argparse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+# 默认识别结果，覆盖各situation的常见回答以及无法识别的情况
+CANNED_TRANSCRIPTS = ['高压一百二低压八十', '高压一百三十五低压九十', '心率七十五', '心率每分钟八十二',
+                      '体重六十五公斤', '体重一百二十斤', '我今天吃了阿司匹林一片', '吃了诺心托两片美托洛尔一片',
+                      '今天状态很好', '没有不舒服', '高压么么久低压八十', '嗯', '']
+
+
+class FakeASRHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # 支持长连接，与SDK客户端的keep-alive一致
+    # 响应头与响应体分两次发送，长连接上开启Nagle算法时每个请求都要等待对端的延迟ACK（约40ms）
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        request_id = str(uuid.uuid4())
+
+        action = self.headers.get('X-TC-Action')
+        if action != 'SentenceRecognition':
+            return self.send_json(self.error(request_id, 'InvalidAction', 'action {} not supported'.format(action)))
+
+        try:
+            params = json.loads(body)
+            data = base64.b64decode(params['Data'])
+        except (ValueError, KeyError) as e:
+            return self.send_json(self.error(request_id, 'InvalidParameter', str(e)))
+
+        config = self.server.config
+        time.sleep(max(0.0, random.gauss(config.latency, config.jitter)) / 1000)
+
+        if random.random() < config.error_rate:
+            return self.send_json(self.error(request_id, 'FailedOperation.ServiceIsolate', 'fake server error'))
+
+        # 同一段音频总是返回同一条文本，与服务端的音频缓存行为一致
+        transcripts = self.server.transcripts
+        index = int(hashlib.md5(data).hexdigest(), 16) % len(transcripts)
+
+        self.send_json({'Response': {'Result': transcripts[index],
+                                     'AudioDuration': len(data) // 4,
+                                     'WordSize': 0,
+                                     'WordList': None,
+                                     'RequestId': request_id}})
+
+    def error(self, request_id, code, message):
+        return {'Response': {'Error': {'Code': code, 'Message': message}, 'RequestId': request_id}}
+
+    def send_json(self, resp):
+        body = json.dumps(resp, ensure_ascii=False).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.config.verbose:
+            super(FakeASRHandler, self).log_message(format, *args)
+
+
+class FakeASRServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # 默认监听队列只有5，压测开始时大量并发连接会被丢弃后重试（约1s）
+    request_queue_size = 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description='fake Tencent Cloud SentenceRecognition server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9000)
+    parser.add_argument('--latency', type=float, default=300, help='mean latency in ms')
+    parser.add_argument('--jitter', type=float, default=100, help='latency standard deviation in ms')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='ratio of FailedOperation responses')
+    parser.add_argument('--transcripts', help='file of transcripts, one per line')
+    parser.add_argument('--verbose', action='store_true')
+    config = parser.parse_args()
+
+    server = FakeASRServer((config.host, config.port), FakeASRHandler)
+    server.config = config
+    server.transcripts = CANNED_TRANSCRIPTS
+    if config.transcripts:
+        with open(config.transcripts, mode='r', encoding='utf-8') as trans_f:
+            server.transcripts = [line.rstrip('\n') for line in trans_f]
+
+    print("fake asr server on {}:{}, latency {}±{}ms, error rate {}".format(
+        config.host, config.port, config.latency, config.jitter, config.error_rate))
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,148 @@
+# ========================================================
+#   Copyright (C) 2018 All rights reserved.
+#
+#   filename : load_test.py
+#   date     : 2026-10-18
+#   desc     : /getAudio 压测，并发回放录制的上传音频，统计吞吐、总延迟与各阶段延迟（Server-Timing）、
+#              返回码（0/1501/1502/1503/1599）分布
+#
+#              python tools/load_test.py --url http://127.0.0.1:8088 --audio-dir tmp/ --concurrency 32 --duration 60
+# ========================================================
+
+import os, sys, json, glob, time, random, argparse, threading
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+
+# utils 包会导入切词模型，这里只需要 Server-Timing 解析
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'utils'))
+from Timing import parse_server_timing
+
+
+class LoadStats(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.stages = defaultdict(list)
+        self.codes = Counter()
+
+    def add(self, latency, code, stages):
+        with self.lock:
+            self.latencies.append(latency)
+            self.codes[code] += 1
+            for name, dur in stages.items():
+                self.stages[name].append(dur)
+
+
+def percentiles(values):
+    values = np.array(values)
+    return {'count': len(values),
+            'mean_ms': float(values.mean()),
+            'p50_ms': float(np.percentile(values, 50)),
+            'p90_ms': float(np.percentile(values, 90)),
+            'p99_ms': float(np.percentile(values, 99)),
+            'max_ms': float(values.max())}
+
+
+def send(session, url, audio, situation, userid, stats):
+    name, data = audio
+    start = time.perf_counter()
+    try:
+        resp = session.post(url, data={'userid': userid, 'situation': situation},
+                            files={'file': (name, data)}, timeout=60)
+        latency = (time.perf_counter() - start) * 1000
+        try:
+            code = resp.json().get('code', 'no_code') if resp.status_code == 200 else 'http_{}'.format(resp.status_code)
+        except ValueError:
+            code = 'bad_json'
+        stats.add(latency, code, parse_server_timing(resp.headers.get('Server-Timing')))
+    except requests.RequestException as e:
+        stats.add((time.perf_counter() - start) * 1000, type(e).__name__, {})
+
+
+# 每个线程一个会话，复用连接
+def worker(args, audios, stats, deadline, counter):
+    session = requests.Session()
+    url = args.url.rstrip('/') + '/getAudio'
+
+    while time.time() < deadline:
+        with counter['lock']:
+            if args.requests and counter['sent'] >= args.requests:
+                return
+            counter['sent'] += 1
+            i = counter['sent']
+
+        send(session, url, random.choice(audios), random.choice(args.situations),
+             '{}{}'.format(args.userid, i % 1000), stats)
+
+
+def load_audios(args):
+    files = list(args.audio or [])
+    if args.audio_dir:
+        for ext in ('mp3', 'wav'):
+            files.extend(glob.glob(os.path.join(args.audio_dir, '*.' + ext)))
+
+    audios = []
+    for filename in sorted(files):
+        with open(filename, mode='rb') as audio_f:
+            audios.append((os.path.basename(filename), audio_f.read()))
+
+    return audios
+
+
+def main():
+    parser = argparse.ArgumentParser(description='load test of /getAudio')
+    parser.add_argument('--url', default='http://127.0.0.1:8088')
+    parser.add_argument('--audio', nargs='+', help='audio files to upload')
+    parser.add_argument('--audio-dir', help='folder of recorded uploads (*.mp3, *.wav)')
+    parser.add_argument('--situations', nargs='+', default=['1', '2'], help='situation of each request, random')
+    parser.add_argument('--userid', default='loadtest')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=30, help='seconds')
+    parser.add_argument('--requests', type=int, default=0, help='stop after this many requests, 0 for no limit')
+    parser.add_argument('--seed', type=int, default=2018)
+    parser.add_argument('-o', '--output', help='result json file')
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    audios = load_audios(args)
+    if not audios:
+        parser.error('no audio, use --audio or --audio-dir')
+
+    stats = LoadStats()
+    counter = {'lock': threading.Lock(), 'sent': 0}
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        for _ in range(args.concurrency):
+            executor.submit(worker, args, audios, stats, start + args.duration, counter)
+    elapsed = time.time() - start
+
+    if not stats.latencies:
+        print('no request finished')
+        return
+
+    report = {'url': args.url,
+              'concurrency': args.concurrency,
+              'audios': len(audios),
+              'elapsed_s': elapsed,
+              'throughput': len(stats.latencies) / elapsed,
+              'latency': percentiles(stats.latencies),
+              'stages': {name: percentiles(durs) for name, durs in stats.stages.items()},
+              'codes': {str(code): count for code, count in stats.codes.most_common()}}
+
+    print("requests {}  elapsed {:.1f}s  throughput {:.1f}/s".format(
+        report['latency']['count'], elapsed, report['throughput']))
+    for name, p in [('total', report['latency'])] + sorted(report['stages'].items()):
+        print("{:<10} n {:>7}  mean {:>9.2f}ms  p50 {:>9.2f}ms  p90 {:>9.2f}ms  p99 {:>9.2f}ms  max {:>9.2f}ms".format(
+            name, p['count'], p['mean_ms'], p['p50_ms'], p['p90_ms'], p['p99_ms'], p['max_ms']))
+    print("codes " + '  '.join("{}: {}".format(code, count) for code, count in report['codes'].items()))
+
+    if args.output:
+        with open(args.output, mode='w', encoding='utf-8') as out_f:
+            json.dump(report, out_f, ensure_ascii=False, indent=2)
+
+
+if __name__ == '__main__':
+    main()
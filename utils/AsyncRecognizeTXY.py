@@ -0,0 +1,111 @@
+# ========================================================
+#   Copyright (C) 2018 All rights reserved.
+#
+#   filename : AsyncRecognizeTXY.py
+#   date     : 2026-10-18
+#   desc     : 腾讯云一句话识别的异步版本，直接以TC3-HMAC-SHA256签名调用接口，
+#              同一时刻的识别请求数受并发上限控制，单个请求有超时
+# ========================================================
+
+import sys, os, json, time
+import asyncio, hashlib, hmac
+from datetime import datetime, timezone
+
+import aiohttp
+
+# for import purpose
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from instance import *
+from utils.RecognizeTXY import BaseASR, ASRServerError, sentence_params
+
+
+def _hmac_sha256(key, msg):
+    return hmac.new(key, msg.encode('utf-8'), hashlib.sha256)
+
+
+# 签名算法 https://cloud.tencent.com/document/api/1093/35641
+def tc3_authorization(secret_id, secret_key, host, service, payload, timestamp):
+    content_type = 'application/json'
+    date = datetime.fromtimestamp(timestamp, timezone.utc).strftime('%Y-%m-%d')
+
+    canonical_request = 'POST\n/\n\ncontent-type:{}\nhost:{}\n\ncontent-type;host\n{}'.format(
+        content_type, host, hashlib.sha256(payload.encode('utf-8')).hexdigest())
+    credential_scope = '{}/{}/tc3_request'.format(date, service)
+    string_to_sign = 'TC3-HMAC-SHA256\n{}\n{}\n{}'.format(
+        timestamp, credential_scope, hashlib.sha256(canonical_request.encode('utf-8')).hexdigest())
+
+    secret_date = _hmac_sha256(('TC3' + secret_key).encode('utf-8'), date).digest()
+    secret_service = _hmac_sha256(secret_date, service).digest()
+    secret_signing = _hmac_sha256(secret_service, 'tc3_request').digest()
+    signature = _hmac_sha256(secret_signing, string_to_sign).hexdigest()
+
+    return 'TC3-HMAC-SHA256 Credential={}/{}, SignedHeaders=content-type;host, Signature={}'.format(
+        secret_id, credential_scope, signature)
+
+
+class AsyncCloudASR(BaseASR):
+    """ Online ASR from Tencent, asyncio version
+
+    需在事件循环中先调用start()创建连接池，退出前调用close()
+    """
+    service = 'asr'
+    version = '2019-06-14'
+    action = 'SentenceRecognition'
+
+    def __init__(self, api_url, app_id, app_key, region=CLOUD_REGION, concurrency=ASYNC_ASR_CONCURRENCY,
+                 timeout=ASYNC_ASR_TIMEOUT, scheme='https'):
+        super(AsyncCloudASR, self).__init__(api_url, app_id, app_key)
+        self.region = region
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.scheme = scheme
+
+        self.semaphore = None
+        self.session = None
+
+    async def start(self):
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.concurrency))
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def stt(self, audio_file):
+        with open(audio_file, mode='rb') as fwave:
+            return await self.stt_data(fwave.read())
+
+    async def stt_data(self, data):
+        payload = json.dumps(sentence_params(data))
+
+        try:
+            # 超时包括排队等待并发名额的时间
+            resp = await asyncio.wait_for(self.request(payload), self.timeout)
+        except asyncio.TimeoutError:
+            raise ASRServerError('ASR request timeout after {}s'.format(self.timeout), 'Timeout')
+        except aiohttp.ClientError as err:
+            raise ASRServerError(str(err), 'ClientError')
+
+        response = resp.get('Response', {})
+        if 'Error' in response:
+            raise ASRServerError(response['Error'].get('Message'), response['Error'].get('Code'))
+
+        return response['Result']
+
+    async def request(self, payload):
+        timestamp = int(time.time())
+        headers = {'Content-Type': 'application/json',
+                   'Host': self.api_url,
+                   'X-TC-Action': self.action,
+                   'X-TC-Version': self.version,
+                   'X-TC-Timestamp': str(timestamp),
+                   'X-TC-Region': self.region,
+                   'Authorization': tc3_authorization(self.app_id, self.app_key, self.api_url, self.service,
+                                                      payload, timestamp)
+                   }
+
+        async with self.semaphore:
+            async with self.session.post('{}://{}/'.format(self.scheme, self.api_url), data=payload.encode('utf-8'),
+                                         headers=headers) as resp:
+                return await resp.json(content_type=None)
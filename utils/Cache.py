@@ -0,0 +1,67 @@
+# ========================================================
+#   Copyright (C) 2018 All rights reserved.
+#
+#   filename : Cache.py
+#   date     : 2026-10-18
+#   desc     : 线程安全的LRU缓存，支持条目过期，记录命中/未命中/淘汰次数
+# ========================================================
+
+import time
+import threading
+from collections import OrderedDict
+
+
+class TTLCache(object):
+    def __init__(self, maxsize, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl  # 秒，None表示不过期
+
+        self.data = OrderedDict()  # key -> (expire_time, value)，最近使用的在末尾
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self.data)
+
+    def get(self, key, default=None):
+        with self.lock:
+            item = self.data.get(key)
+            if item is not None and (item[0] is None or item[0] > time.monotonic()):
+                self.data.move_to_end(key)
+                self.hits += 1
+                return item[1]
+
+            if item is not None:  # 已过期
+                del self.data[key]
+                self.evictions += 1
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+
+        expire_time = None if self.ttl is None else time.monotonic() + self.ttl
+        with self.lock:
+            self.data[key] = (expire_time, value)
+            self.data.move_to_end(key)
+
+            while len(self.data) > self.maxsize:
+                self.data.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+    def stats(self):
+        with self.lock:
+            return {'size': len(self.data),
+                    'maxsize': self.maxsize,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions
+                    }
@@ -0,0 +1,196 @@
+# ========================================================
+#   Copyright (C) 2018 All rights reserved.
+#
+#   filename : Engines.py
+#   date     : 2026-10-18
+#   desc     : 切词模型、改错索引等在后台线程中加载，服务启动后立即监听端口，
+#              /readyz 在全部加载完成后才返回200；
+#              字典更新后在后台构建新对象，构建完成后替换引用，进行中的请求继续使用旧对象
+# ========================================================
+
+import os, sys, time, uuid, threading, traceback
+
+# for import purpose
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from instance import *
+from utils.Logger import logger
+from utils.Pipeline import get_dict_version
+
+
+class EngineNotReadyError(Exception):
+    def __init__(self, name, message):
+        self.name = name
+        self.message = message
+
+    def __str__(self):
+        return "[EngineNotReady] {}: {}".format(self.name, self.message)
+
+
+class LazyEngine(object):
+    """
+    后台线程中调用factory()构建对象，get()等待构建完成后返回
+    """
+
+    def __init__(self, name, factory):
+        self.name = name
+        self.factory = factory
+
+        self.instance = None
+        self.error = None
+        self.load_time = None
+        self.loaded = threading.Event()
+
+        self.reload_lock = threading.Lock()
+        self.reloads = 0
+
+    def start(self):
+        threading.Thread(target=self.load, name="load-" + self.name, daemon=True).start()
+        return self
+
+    def load(self):
+        start = time.time()
+        try:
+            self.instance = self.factory()
+            self.load_time = time.time() - start
+            logger.info("[Engine] {} loaded in {:.1f}s".format(self.name, self.load_time))
+        except Exception:
+            self.error = traceback.format_exc()
+            logger.error("[Engine] {} load failed {}".format(self.name, self.error.replace("\n", "\t")))
+        finally:
+            self.loaded.set()
+
+    # 后台构建新对象，成功后一次赋值替换，失败时继续使用旧对象
+    # 已有重载在进行时返回False
+    def reload(self):
+        if not self.reload_lock.acquire(blocking=False):
+            return False
+        threading.Thread(target=self._reload, name="reload-" + self.name, daemon=True).start()
+        return True
+
+    def _reload(self):
+        try:
+            self.loaded.wait()
+            start = time.time()
+            try:
+                instance = self.factory()
+            except Exception:
+                logger.error("[Engine] {} reload failed, keep old version {}".format(
+                    self.name, traceback.format_exc().replace("\n", "\t")))
+                return
+
+            old, self.instance = self.instance, instance
+            self.error = None
+            self.load_time = time.time() - start
+            self.reloads += 1
+            logger.info("[Engine] {} reloaded in {:.1f}s".format(self.name, self.load_time))
+
+            # 旧对象持有进程池时，等进行中的请求结束后再关闭
+            if old is not None and hasattr(old, 'close'):
+                threading.Timer(RELOAD_GRACE, old.close).start()
+        finally:
+            self.reload_lock.release()
+
+    @property
+    def ready(self):
+        return self.loaded.is_set() and self.error is None
+
+    def wait(self, timeout=None):
+        return self.loaded.wait(timeout)
+
+    # 未加载完成时最多等待timeout秒
+    def get(self, timeout=ENGINE_WAIT_TIMEOUT):
+        if not self.loaded.wait(timeout):
+            raise EngineNotReadyError(self.name, "still loading")
+        if self.error is not None:
+            raise EngineNotReadyError(self.name, "load failed")
+        return self.instance
+
+    def status(self):
+        if not self.loaded.is_set():
+            return "loading"
+        return "ready" if self.error is None else "failed"
+
+
+# 各引擎的状态，供 /readyz 返回
+def engines_status(engines):
+    ready = all(engine.ready for engine in engines)
+    resSets = {'code': 0 if ready else 1,
+               'ready': ready,
+               'engines': {engine.name: engine.status() for engine in engines}
+               }
+    return ready, resSets
+
+
+# 重载标记，文件不存在时为None
+def read_reload_token(reload_file=RELOAD_FILE):
+    try:
+        with open(reload_file, mode='r', encoding='utf-8') as reload_f:
+            return reload_f.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+# 写入新的重载标记，先写临时文件再替换，其他进程不会读到写了一半的内容
+def write_reload_token(reload_file=RELOAD_FILE):
+    token = uuid.uuid4().hex
+    os.makedirs(os.path.dirname(reload_file), exist_ok=True)
+    tmp_file = "{}.{}".format(reload_file, os.getpid())
+    with open(tmp_file, mode='w', encoding='utf-8') as reload_f:
+        reload_f.write(token)
+    os.replace(tmp_file, reload_file)
+    return token
+
+
+# 定期检查重载标记与字典版本，标记或字典文件变化后重载全部引擎；
+# gunicorn多worker部署时每个worker各自启动（见gunicorn.conf.py post_fork），
+# /admin/reload 只到达一个worker，通过重载标记通知其他worker
+class DictWatcher(object):
+    def __init__(self, engines, interval=RELOAD_INTERVAL, poll_interval=RELOAD_POLL_INTERVAL,
+                 reload_file=RELOAD_FILE):
+        self.engines = engines
+        self.interval = interval
+        self.poll_interval = poll_interval
+        self.reload_file = reload_file
+        self.dict_version = get_dict_version()
+        self.reload_token = read_reload_token(reload_file)
+        self.pid = None
+
+    def start(self):
+        if self.pid == os.getpid():
+            return self
+        self.pid = os.getpid()
+        threading.Thread(target=self.watch, name="dict-watcher", daemon=True).start()
+        return self
+
+    # 重载全部引擎，返回开始重载的引擎名（已在重载中的不重复开始）
+    def reload(self):
+        return [engine.name for engine in self.engines if engine.reload()]
+
+    # 重载本进程，并通知其他进程重载
+    def reload_all(self):
+        self.reload_token = write_reload_token(self.reload_file)
+        return self.reload()
+
+    def watch(self):
+        last_check = time.time()
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                reload_token = read_reload_token(self.reload_file)
+                if reload_token != self.reload_token:
+                    logger.info("[DictWatcher] reload requested {}".format(reload_token))
+                    self.reload_token = reload_token
+                    self.reload()
+                    continue
+
+                if self.interval <= 0 or time.time() - last_check < self.interval:
+                    continue
+                last_check = time.time()
+                dict_version = get_dict_version()
+            except Exception:
+                logger.error("[DictWatcher] {}".format(traceback.format_exc().replace("\n", "\t")))
+                continue
+            if dict_version != self.dict_version:
+                logger.info("[DictWatcher] dict version {} -> {}, reload".format(self.dict_version, dict_version))
+                self.dict_version = dict_version
+                self.reload()
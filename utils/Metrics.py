@@ -0,0 +1,101 @@
+# ========================================================
+#   Copyright (C) 2018 All rights reserved.
+#
+#   filename : Metrics.py
+#   date     : 2026-10-18
+#   desc     : Prometheus 指标：请求总耗时、各阶段耗时直方图，按situation、返回码计数，由 /metrics 导出
+#              gunicorn多worker部署时设置环境变量 PROMETHEUS_MULTIPROC_DIR，各worker的指标汇总后导出
+#              各缓存（识别结果缓存、处理流程结果缓存）的大小与命中、未命中、淘汰次数在导出时读取
+# ========================================================
+
+import os
+
+from prometheus_client import Counter, Histogram, CollectorRegistry, REGISTRY, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client import multiprocess
+from prometheus_client.core import GaugeMetricFamily, CounterMetricFamily
+
+# 0.5ms 到 30s，覆盖切词、纠正（毫秒级）到识别调用（秒级）
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+REQUEST_LATENCY = Histogram('nih_audio_request_seconds', 'request latency', ['endpoint'],
+                            buckets=LATENCY_BUCKETS)
+STAGE_LATENCY = Histogram('nih_audio_stage_seconds', 'latency of each stage in request', ['endpoint', 'stage'],
+                          buckets=LATENCY_BUCKETS)
+REQUESTS = Counter('nih_audio_requests_total', 'requests by situation', ['endpoint', 'situation'])
+RESULTS = Counter('nih_audio_results_total', 'responses by result code', ['endpoint', 'code'])
+
+# situation来自客户端输入，取值之外的一律记为other，避免任意取值产生无限多的时间序列
+SITUATION_LABELS = {'0', '1', '2', '3', 'batch'}
+
+
+# 记录一个请求：timer为StageTimer，code为返回结果中的code（0/1501/1502/1503/1599）
+def observe_request(endpoint, timer, situation, code):
+    REQUEST_LATENCY.labels(endpoint).observe(timer.elapsed())
+    for stage, dur in timer.durations.items():
+        STAGE_LATENCY.labels(endpoint, stage).observe(dur / 1000)
+
+    if situation is not None:
+        situation = str(situation)
+        if situation not in SITUATION_LABELS:
+            situation = 'other'
+        REQUESTS.labels(endpoint, situation).inc()
+    RESULTS.labels(endpoint, str(code)).inc()
+
+
+class CacheCollector(object):
+    """
+    导出时读取已注册缓存的统计（TTLCache.stats() 格式），无需在每次读写缓存时更新指标
+    """
+
+    def __init__(self):
+        self.caches = {}  # name -> 返回统计的函数，返回None时跳过（如处理流程尚未加载完成）
+
+    def register(self, name, get_stats):
+        self.caches[name] = get_stats
+
+    def collect(self):
+        size = GaugeMetricFamily('nih_audio_cache_size', 'entries in cache', labels=['cache'])
+        maxsize = GaugeMetricFamily('nih_audio_cache_maxsize', 'capacity of cache', labels=['cache'])
+        hits = CounterMetricFamily('nih_audio_cache_hits', 'cache hits', labels=['cache'])
+        misses = CounterMetricFamily('nih_audio_cache_misses', 'cache misses', labels=['cache'])
+        evictions = CounterMetricFamily('nih_audio_cache_evictions', 'expired or evicted entries', labels=['cache'])
+
+        for name, get_stats in list(self.caches.items()):
+            stats = get_stats()
+            if stats is None:
+                continue
+            size.add_metric([name], stats['size'])
+            maxsize.add_metric([name], stats['maxsize'])
+            hits.add_metric([name], stats['hits'])
+            misses.add_metric([name], stats['misses'])
+            evictions.add_metric([name], stats['evictions'])
+
+        return [size, maxsize, hits, misses, evictions]
+
+
+CACHE_COLLECTOR = CacheCollector()
+REGISTRY.register(CACHE_COLLECTOR)
+
+
+# 注册需要导出统计的缓存，get_stats 返回 TTLCache.stats() 格式的字典
+def register_cache(name, get_stats):
+    CACHE_COLLECTOR.register(name, get_stats)
+
+
+# /metrics 响应内容
+def export_metrics():
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        # 缓存统计无法跨进程汇总，导出的是处理本次请求的worker的缓存
+        registry.register(CACHE_COLLECTOR)
+    else:
+        registry = REGISTRY
+
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+# gunicorn worker退出后清理其指标文件
+def mark_process_dead(pid):
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        multiprocess.mark_process_dead(pid)
@@ -11,12 +11,18 @@
 #   desc     :
 # ========================================================
 
-import os, sys, copy, time
+import os, sys, time, hashlib, pickle, shutil, fcntl, threading
 from pathlib import Path
 from enum import Enum, unique
+from functools import lru_cache
+from collections import Counter
+from contextlib import contextmanager
 
+import numpy as np
+import pypinyin
 from pypinyin import pinyin, lazy_pinyin, Style
 from pypinyin.style import convert
+from pypinyin.seg.simpleseg import seg as pinyin_seg
 
 ## 单测使用
 #    --------------------   字典
@@ -35,6 +41,12 @@ from pypinyin.style import convert
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
 from instance.Variable import *
 
+# version of the serialized index format, bump it whenever cached attributes change
+INDEX_FORMAT_VERSION = 4
+
+# with at least this many live candidates, tail scores of a character are gathered with one array operation
+BULK_ADVANCE_MIN = 32
+
 # utils update by shenge
 def get_pinyin_for_match(pinyin_tone_list):
     result = {}
@@ -61,18 +73,161 @@ class ASR_Corrector_FuzzyLevel(Enum):
     MoreStrict = 2
 
 
-# jump table entry, head for all items passed start_th, tail are all sim scores excluding start pinyin
-class JumpTableEntry(object):
-    def __init__(self, num):
-        self.head_table = []
-        self.tail_table = [[] for i in range(num)]
+# jump table for all pinyins, head for all items passed start_th, tail are all sim scores excluding start pinyin
+# tails of all items are packed into one (pinyin id, tail column) matrix, item_id locates its columns by offsets
+# matrix keeps the index of score in score_levels instead of the score itself, one byte per entry
+class JumpTable(object):
+    def __init__(self, py_ids, score_levels, tail_lens):
+        self.py_ids = py_ids
+        self.score_levels = score_levels  # ascending, so max of index is index of max score
+
+        self.head_tables = [[] for i in range(len(py_ids))]
+
+        offsets = [0]
+        for l in tail_lens:
+            offsets.append(offsets[-1] + l)
+        self.tail_offsets = offsets
+        self.tail_codes = np.zeros((len(py_ids), offsets[-1]), dtype=np.uint8)
+
+        self.batch_arrays = None
 
     def __repr__(self):
-        return f"[head-> {self.head_table}, tail-> {self.tail_table}]"
+        return f"[pinyins-> {len(self.py_ids)}, items-> {len(self.tail_offsets) - 1}, tail shape-> {self.tail_codes.shape}]"
+
+    def __contains__(self, py):
+        return py in self.py_ids
+
+    def get_head_table(self, py):
+        return self.head_tables[self.py_ids[py]]
+
+    # head tables flattened into arrays (pointer by pinyin id, item ids, scores) for batch matching
+    def get_batch_arrays(self):
+        if self.batch_arrays is None:
+            head_ptr = [0]
+            for head_table in self.head_tables:
+                head_ptr.append(head_ptr[-1] + len(head_table))
+
+            self.batch_arrays = (np.array(head_ptr, dtype=np.int64),
+                                 np.array([item_id for head_table in self.head_tables for item_id, _ in head_table],
+                                          dtype=np.int64),
+                                 np.array([score for head_table in self.head_tables for _, score in head_table],
+                                          dtype=np.float64),
+                                 np.array(self.tail_offsets, dtype=np.int64))
+
+        return self.batch_arrays
+
+    # copy to be changed while readers keep using this table, head lists are copied, tail matrix is shared:
+    # append_item only writes columns past the last item, which readers of this table never index
+    def copy(self):
+        table = JumpTable(self.py_ids, self.score_levels, [])
+        table.head_tables = [list(head_table) for head_table in self.head_tables]
+        table.tail_offsets = list(self.tail_offsets)
+        table.tail_codes = self.tail_codes
+
+        return table
+
+    # reserve tail columns for a new item at the end, returns its item id
+    # matrix grows with spare columns for later items, read-only (memory-mapped) matrix is copied to private memory
+    def append_item(self, tail_len):
+        item_id = len(self.tail_offsets) - 1
+        used, end = self.tail_offsets[-1], self.tail_offsets[-1] + tail_len
+
+        if end > self.tail_codes.shape[1] or not self.tail_codes.flags.writeable:
+            capacity = max(end, used + used // 4, 64)
+            tail_codes = np.zeros((len(self.py_ids), capacity), dtype=np.uint8)
+            tail_codes[:, :used] = self.tail_codes[:, :used]
+            self.tail_codes = tail_codes
+
+        self.tail_offsets.append(end)
+        return item_id
+
+    # drop item from head tables so no match starts from it, its tail columns are left unused
+    def remove_item(self, item_id):
+        for py_id, head_table in enumerate(self.head_tables):
+            if any(i == item_id for i, _ in head_table):
+                self.head_tables[py_id] = [entry for entry in head_table if entry[0] != item_id]
+
+    # best tail score among all pinyins of a character, pos counts from item start (pos >= 1)
+    def get_tail_score(self, ch_py, item_id, pos):
+        col = self.tail_offsets[item_id] + pos - 1
+        code = 0
+        for k in ch_py:
+            py_id = self.py_ids.get(k)
+            if py_id is not None:
+                code = max(code, self.tail_codes[py_id, col])
+
+        return self.score_levels[code]
+
+    # plain data for serialization, so the index file does not depend on module path
+    def get_state(self):
+        return self.head_tables, self.tail_offsets
+
+    @classmethod
+    def from_state(cls, py_ids, score_levels, state, tail_codes):
+        table = cls(py_ids, score_levels, [])
+        table.head_tables, table.tail_offsets = state
+        table.tail_codes = tail_codes
+
+        return table
+
+
+# multi-pattern replacement, all rules are compiled into a trie and applied in one pass over text
+# leftmost-longest: at each position the longest rule wins, scan continues right after the replaced part
+# so cost only depends on text length and longest rule, not on number of rules
+class TextReplacer(object):
+    def __init__(self, rules):
+        self.trie = {}
+        self.end_key = ''  # never collides with a character
+
+        for k, v in rules:
+            if not k:
+                continue
+
+            node = self.trie
+            for ch in k:
+                node = node.setdefault(ch, {})
+            node.setdefault(self.end_key, v)  # first rule wins for repeated keys
+
+    def replace(self, text):
+        if not self.trie:
+            return text
+
+        result = []
+        pos, last, text_len = 0, 0, len(text)
+        while pos < text_len:
+            node = self.trie.get(text[pos])
+            if node is None:
+                pos += 1
+                continue
+
+            # walk down the trie and remember the longest rule
+            match_end, match_value = -1, None
+            i = pos + 1
+            while node is not None:
+                if self.end_key in node:
+                    match_end, match_value = i, node[self.end_key]
+                if i >= text_len:
+                    break
+                node = node.get(text[i])
+                i += 1
+
+            if match_end < 0:
+                pos += 1
+                continue
+
+            result.append(text[last:pos])
+            result.append(match_value)
+            pos = last = match_end
+
+        result.append(text[last:])
+
+        return ''.join(result)
 
 
 # match status, keeping track of specific matches
 class MatchStatus(object):
+    __slots__ = ('text', 'max_ch_score', 'item_id', 'cur_pos', 'item_len', 'text_start_pos', 'sum_score', 'score_th')
+
     def __init__(self, id, text, the_item_len, text_start, match_score, sum_score_th, max_single_score):
         self.text = text
         self.max_ch_score = max_single_score
@@ -99,6 +254,38 @@ class MatchStatus(object):
         return False, False
 
 
+# work done by correction calls, one per call and one aggregated in corrector when stats are enabled
+# started: candidates created from head tables, each one ends as pruned or passed
+# filtered: passed matches dropped by filter_match_special, phase times in seconds
+class CorrectionStats(object):
+    phases = ('prepare', 'match', 'post')
+
+    def __init__(self):
+        self.calls = 0
+        self.started = 0
+        self.pruned = 0
+        self.passed = 0
+        self.filtered = 0
+        self.phase_time = dict.fromkeys(self.phases, 0.0)
+
+    def __repr__(self):
+        return f"[calls: {self.calls}, started: {self.started}, pruned: {self.pruned}, passed: {self.passed}, filtered: {self.filtered}, time: {self.phase_time}]"
+
+    def add(self, other):
+        self.calls += other.calls
+        self.started += other.started
+        self.pruned += other.pruned
+        self.passed += other.passed
+        self.filtered += other.filtered
+        for phase in self.phases:
+            self.phase_time[phase] += other.phase_time[phase]
+
+    def to_dict(self):
+        return {'calls': self.calls, 'started': self.started, 'pruned': self.pruned, 'passed': self.passed,
+                'filtered': self.filtered,
+                'phase_ms': {phase: t * 1000 for phase, t in self.phase_time.items()}}
+
+
 # the main corrector class
 class ASR_Corrector(object):
     def __init__(self, fuzzy_level=ASR_Corrector_FuzzyLevel.Normal,
@@ -107,14 +294,27 @@ class ASR_Corrector(object):
                  rep_rule=DICT_PRE_RULE,
                  filter_dict=DICT_FILTER_RULE,
                  custom_dict=DICT_CUSTOM,
-                 extra_dict=None):
+                 extra_dict=None,
+                 index_cache=INDEX_CACHE_DIR,
+                 share_index=INDEX_SHARED):
         self.init(fuzzy_level)
-        self.load_filter_rule(filter_dict)
-        self.load_dict_file(hf_dict)
+        self.share_index = share_index
         self.load_py_dict_file(py_dict)
         self.load_rule(rep_rule)
-        self.custom_process(custom_dict, extra_dict)
-        self.build_index()
+
+        # warm start from serialized index if dict files and thresholds are unchanged
+        # lock makes concurrently started workers wait for the first one instead of all building
+        index_key = self.get_index_key(hf_dict, py_dict, filter_dict, custom_dict, extra_dict)
+        with self.lock_index(index_cache, index_key):
+            if self.load_index(index_cache, index_key):
+                return
+
+            self.load_filter_rule(filter_dict)
+            self.load_dict_file(hf_dict)
+            self.custom_process(custom_dict, extra_dict)
+            self.build_char_py_table()
+            self.build_index()
+            self.save_index(index_cache, index_key)
 
     # all the initializations are done here
     def init(self, fuzzy_level):
@@ -157,6 +357,14 @@ class ASR_Corrector(object):
 
         self.med_names = set()
         self.med_py_list = []
+        self.update_lock = threading.Lock()  # serializes runtime add_item / remove_item
+        self.removed_items = {}  # name -> item id of items removed at runtime, their rows are kept for add_item
+
+        # opt-in statistics of correction calls, see enable_stats
+        self.stats_enabled = False
+        self.stats_hook = None
+        self.stats_lock = threading.Lock()
+        self.total_stats = CorrectionStats()
 
         self.filter_pre_dict = {}
         self.filter_dict = {}
@@ -185,16 +393,33 @@ class ASR_Corrector(object):
                                 'nn': 0.0
                                 }
 
+        # pinyin of transcript characters, common characters are precomputed, other words are cached
+        self.char_py_table = {}
+        self.word_py_cache = lru_cache(maxsize=PY_CACHE_SIZE)(
+            lambda word: tuple(self.convert_item_py(word, heteronym=True)))
+
+        # scores of pairs with non-standard pinyins (digits, letters in transcript or items), not in sim matrix
+        self.odd_score_cache = lru_cache(maxsize=ODD_SCORE_CACHE_SIZE)(self.compute_single_match_score)
+
         # index related
         self.all_pinyin = {}
-        self.sim_score_cache = {}
-        self.jump_table = {}
+        self.py_ids = {}  # pinyin -> integer id, row of sim matrix and jump tables
+        self.sim_matrix = None  # similarity scores between all pinyins
+        self.sim_codes = None  # same as sim_matrix, kept as index into score_levels
+        self.jump_table = None
+
+        # all possible scores in jump tables, ascending
+        self.score_levels = sorted(set(self.fuzzy_score_map.values()) | {0.0})
+        self.score_values = np.array(self.score_levels, dtype=np.float64)
+        self.start_code = next(code for code, score in enumerate(self.score_levels + [float('inf')])
+                               if score >= self.start_th)
 
         # pre-process related initialization
         # for remove chinese punctuations
         self.cn_remove_table = str.maketrans(dict.fromkeys('，；、。？！'))
         # for saving bad case, do some replace
         self.replace_list = []
+        self.text_replacer = TextReplacer(self.replace_list)
 
         # special character handling, syntax only work for python 3.5+
         self.special_placeholder = '_'
@@ -233,16 +458,26 @@ class ASR_Corrector(object):
             '8': [{'ba': ('b', 'a')}],     '9': [{'jiou': ('j', 'iou')}],
             '.': [{'dian': ('d', 'ian')}]
         }
-        self.jump_table_special = {}
+        self.jump_table_special = None
+
+        # assign column number, easier for future changes
+        self.special_pinyin_col = 4
+        self.special_pinyin_len_col = 5
+
+    # find dict file, falling back to the file shipped in dict folder
+    def resolve_dict_path(self, dict_file, default_name):
+        dict_path = Path(dict_file)
+        if not dict_path.is_file():  # file not exists, we search for correct file
+            dict_path = Path(__file__).resolve().parent / '../dict' / default_name
+
+        return dict_path
 
     # load filter rule
     def load_filter_rule(self, filter_dict):
         if filter_dict is None:
             return
 
-        filter_dict_path = Path(filter_dict)
-        if not filter_dict_path.is_file():  # file not exists, we search for correct file
-            filter_dict_path = Path(__file__).resolve().parent / '../dict/dict_filter_rule.txt'
+        filter_dict_path = self.resolve_dict_path(filter_dict, 'dict_filter_rule.txt')
 
         with open(str(filter_dict_path), mode='r', encoding='utf-8') as filter_dict_f:
             for line in filter_dict_f:
@@ -256,9 +491,7 @@ class ASR_Corrector(object):
         if hf_dict is None:
             return
 
-        dict_path = Path(hf_dict)
-        if not dict_path.is_file():  # file not exists, we search for correct file
-            dict_path = Path(__file__).resolve().parent / '../dict/hf_dict_utf8.txt'
+        dict_path = self.resolve_dict_path(hf_dict, 'hf_dict_utf8.txt')
 
         with open(str(dict_path), mode='r', encoding='utf-8') as dict_f:
             for line in dict_f:
@@ -278,9 +511,7 @@ class ASR_Corrector(object):
 
     # load all possible pinyin list, for building indices
     def load_py_dict_file(self, py_dict):
-        py_dict_path = Path(py_dict)
-        if not py_dict_path.is_file():  # file not exists, we search for correct file
-            py_dict_path = Path(__file__).resolve().parent / '../dict/pinyin_list.txt'
+        py_dict_path = self.resolve_dict_path(py_dict, 'pinyin_list.txt')
 
         with open(str(py_dict_path), mode='r', encoding='utf-8') as dict_f:
             for line in dict_f:
@@ -288,14 +519,43 @@ class ASR_Corrector(object):
 
                 self.all_pinyin[s[0]] = (s[1], s[2])
 
+        self.py_ids = {k: py_id for py_id, k in enumerate(self.all_pinyin)}
+        self.build_sim_matrix()
+
+    # precompute similarity scores for all pairs of pinyins, same rules as get_single_match_score
+    def build_sim_matrix(self):
+        initials = [v[0] for v in self.all_pinyin.values()]
+        finals = [v[1] for v in self.all_pinyin.values()]
+
+        # 0 for 'm', 1 for 'f', 2 for 'n', see get_py_part_match_status
+        def get_part_status_matrix(py_fuzzy_map, py_parts):
+            part_ids, mapped_ids = {}, {}
+            part_id = np.array([part_ids.setdefault(p, len(part_ids)) for p in py_parts])
+            mapped_id = np.array([mapped_ids.setdefault(self.get_mapped_py(py_fuzzy_map, p), len(mapped_ids))
+                                  for p in py_parts])
+
+            status = np.full((len(py_parts), len(py_parts)), 2, dtype=np.int64)
+            status[mapped_id[:, None] == mapped_id[None, :]] = 1
+            status[part_id[:, None] == part_id[None, :]] = 0
+
+            return status
+
+        status_chars = 'mfn'
+        tuple_scores = np.array([[self.fuzzy_score_map[f"{i}{f}"] for f in status_chars] for i in status_chars])
+
+        self.sim_matrix = tuple_scores[get_part_status_matrix(self.py_initial_fuzzy_map, initials),
+                                       get_part_status_matrix(self.py_final_fuzzy_map, finals)]
+        full_status = get_part_status_matrix(self.py_full_fuzzy_map, list(self.all_pinyin))
+        self.sim_matrix[full_status == 1] = self.fuzzy_score_map['f']  # for overall fuzzy mapping rule
+
+        self.sim_codes = np.searchsorted(np.array(self.score_levels), self.sim_matrix).astype(np.uint8)
+
     # load pre-process rules, to get rid of some stubborn bad cases
     def load_rule(self, rep_rule):
         if rep_rule is None:
             return
 
-        rep_rule_path= Path(rep_rule)
-        if not rep_rule_path.is_file():  # file not exists, we search for correct file
-            rep_rule_path = Path(__file__).resolve().parent / '../dict/dict_pre_rule.txt'
+        rep_rule_path = self.resolve_dict_path(rep_rule, 'dict_pre_rule.txt')
 
         with open(str(rep_rule_path), mode='r', encoding='utf-8') as dict_f:
             for line in dict_f:
@@ -303,12 +563,13 @@ class ASR_Corrector(object):
 
                 self.replace_list.append((s[0], s[1]))
 
+        # compile once, preprocess then does a single pass no matter how many rules
+        self.text_replacer = TextReplacer(self.replace_list)
+
     # add some temporary custom terms to the system
     def custom_process(self, custom_dict, extra_dict):
         if custom_dict:
-            custom_dict_path = Path(custom_dict)
-            if not custom_dict_path.is_file():  # file not exists, we search for correct file
-                custom_dict_path = Path(__file__).resolve().parent / '../dict/dict_custom.txt'
+            custom_dict_path = self.resolve_dict_path(custom_dict, 'dict_custom.txt')
 
             with open(str(custom_dict_path), mode='r', encoding='utf-8') as dict_f:
                 for line in dict_f:
@@ -322,6 +583,34 @@ class ASR_Corrector(object):
 
     # get pinyin list for given text
     def get_item_py(self, item, heteronym=False):
+        if heteronym is not True:
+            return self.convert_item_py(item)
+
+        # after segmentation pinyin of a word does not depend on its neighbours, so it can be looked up
+        item_py = []
+        for word in pinyin_seg(item):
+            if word in self.char_py_table:
+                item_py.append(self.char_py_table[word])
+            else:
+                item_py.extend(self.word_py_cache(word))
+
+        return item_py
+
+    # pinyin of common characters (GB2312 hanzi), used when character is not part of a phrase
+    def build_char_py_table(self):
+        for hi in range(0xB0, 0xF8):
+            for lo in range(0xA1, 0xFF):
+                try:
+                    ch = bytes([hi, lo]).decode('gb2312')
+                except UnicodeDecodeError:
+                    continue
+
+                ch_py = self.convert_item_py(ch, heteronym=True)
+                if len(ch_py) == 1:
+                    self.char_py_table[ch] = ch_py[0]
+
+    # convert text to pinyin list using pypinyin, no cache
+    def convert_item_py(self, item, heteronym=False):
         pys = []
 
         # get different type of pinyin, based on input flag
@@ -419,56 +708,285 @@ class ASR_Corrector(object):
         # currently we have two kind of indices to support two types of API
         self.med_py_list.append((item, item_py, len(item), item_s, item_py_s, len(item_s)))
 
-        # assign column number, easier for future changes
-        self.special_pinyin_col = 4
-        self.special_pinyin_len_col = 5
-
     # build indices
     def build_index(self):
         # build common index
-        for k, v in self.all_pinyin.items():
-            cur_entry = JumpTableEntry(len(self.med_py_list))
-
-            for item_id, item in enumerate(self.med_py_list):
-                py_list = item[1]
-                l = min(len(py_list), item[2])
-
-                for i in range(l):
-                    # get top-1 result, if program is correct, length will be exactly 1
-                    py, py_part = next(iter(py_list[i].items()))
-
-                    score = self.get_single_match_score(k, v, py, py_part)
-
-                    if i == 0:  # start ch
-                        if score >= self.start_th:
-                            cur_entry.head_table.append((item_id, score))
-                    else:
-                        cur_entry.tail_table[item_id].append(score)
+        tail_lens = [max(0, min(len(item[1]), item[2]) - 1) for item in self.med_py_list]
+        self.jump_table = JumpTable(self.py_ids, self.score_levels, tail_lens)
+
+        for item_id, item in enumerate(self.med_py_list):
+            self.add_item_to_table(self.jump_table, item_id, self.get_index_py(item))
+
+        # build special index, need to process multiple case
+        tail_lens = [max(0, item[self.special_pinyin_len_col] - 1) for item in self.med_py_list]
+        self.jump_table_special = JumpTable(self.py_ids, self.score_levels, tail_lens)
+
+        for item_id, item in enumerate(self.med_py_list):
+            self.add_item_to_table(self.jump_table_special, item_id, self.get_index_py_special(item))
+
+    # pinyins of item indexed in common table
+    def get_index_py(self, item):
+        l = min(len(item[1]), item[2])
+
+        # get top-1 result, if program is correct, length will be exactly 1
+        return [dict([next(iter(ch_py.items()))]) for ch_py in item[1][:l]]
+
+    # pinyins of item indexed in special table
+    def get_index_py_special(self, item):
+        return item[self.special_pinyin_col][:item[self.special_pinyin_len_col]]
+
+    # add item at runtime, only head entries and tail columns of the new item are written
+    # an item removed before gets its old row and tail columns back, only head entries are written again
+    # returns False if item is too short or already exists
+    def add_item(self, item):
+        with self.update_lock:
+            item_id = self.removed_items.get(item)
+            if item_id is None:
+                item_id = len(self.med_py_list)
+                self.add_item_to_pylist(item)
+                if len(self.med_py_list) == item_id:
+                    return False
+            else:
+                self.med_names.add(item)
+                if item in self.filter_pre_dict:
+                    item_s = self.med_py_list[item_id][3]
+                    self.filter_dict[item_s] = [len(item_s)]
+            is_new = item not in self.removed_items
+
+            # same tail lengths as build_index, new item is written to copies of the tables
+            # which replace the old ones at once, a call in progress keeps using the tables it started with
+            med_item = self.med_py_list[item_id]
+            jump_table = self.jump_table.copy()
+            if is_new:
+                jump_table.append_item(max(0, min(len(med_item[1]), med_item[2]) - 1))
+            self.add_item_to_table(jump_table, item_id, self.get_index_py(med_item), with_tail=is_new)
+
+            jump_table_special = self.jump_table_special.copy()
+            if is_new:
+                jump_table_special.append_item(max(0, med_item[self.special_pinyin_len_col] - 1))
+            self.add_item_to_table(jump_table_special, item_id, self.get_index_py_special(med_item), with_tail=is_new)
+
+            self.jump_table, self.jump_table_special = jump_table, jump_table_special
+            self.removed_items.pop(item, None)
+
+        return True
+
+    # remove item at runtime, entries in med_py_list are kept so item ids stay unchanged,
+    # v0 skips removed items, v1 and v2 never start a match from them
+    # rows and tail columns are reused when the item is added again, so they are bounded by distinct names ever added
+    # returns False if item does not exist
+    def remove_item(self, item):
+        with self.update_lock:
+            if item not in self.med_names:
+                return False
+            self.med_names.discard(item)
+
+            # removed from copies of the tables, published at once as in add_item
+            jump_table, jump_table_special = self.jump_table.copy(), self.jump_table_special.copy()
+            for item_id, med_item in enumerate(self.med_py_list):
+                if med_item[0] == item:
+                    jump_table.remove_item(item_id)
+                    jump_table_special.remove_item(item_id)
+                    self.removed_items[item] = item_id
+                    if item in self.filter_pre_dict:
+                        self.filter_dict.pop(med_item[3], None)
+
+            self.jump_table, self.jump_table_special = jump_table, jump_table_special
+
+        return True
+
+    # fill head and tail of one item, scores of all pinyins against item character are one column of sim codes
+    # with_tail=False only writes head entries, tail columns are already filled
+    def add_item_to_table(self, table, item_id, py_list, with_tail=True):
+        col = table.tail_offsets[item_id] - 1
+
+        for i, ch_py in enumerate(py_list):
+            if i > 0 and not with_tail:
+                break
+            codes = self.get_sim_codes(ch_py)
+
+            if i == 0:  # start ch
+                for py_id in np.nonzero(codes >= self.start_code)[0].tolist():
+                    table.head_tables[py_id].append((item_id, self.score_levels[codes[py_id]]))
+            else:
+                table.tail_codes[:, col + i] = codes
+
+    # score codes of all pinyins against a character, best one if character has multiple pinyins
+    def get_sim_codes(self, ch_py):
+        codes = np.zeros(len(self.py_ids), dtype=np.uint8)
+
+        for py, py_part in ch_py.items():
+            py_id = self.py_ids.get(py)
+            if py_id is not None:
+                cur_codes = self.sim_codes[:, py_id]
+            else:  # not a standard pinyin, such as special character pinyin part, compute one by one
+                cur_codes = np.searchsorted(np.array(self.score_levels),
+                                            [self.get_single_match_score(k, v, py, py_part, use_cache=False)
+                                             for k, v in self.all_pinyin.items()]).astype(np.uint8)
+            codes = np.maximum(codes, cur_codes)
+
+        return codes
+
+    # key of serialized index, any change of dict contents, thresholds or pypinyin version gives a new key
+    def get_index_key(self, hf_dict, py_dict, filter_dict, custom_dict, extra_dict):
+        key_hash = hashlib.sha1()
+        key_hash.update(f"{INDEX_FORMAT_VERSION}|{pypinyin.__version__}|{self.start_th}".encode('utf-8'))
+        key_hash.update(repr(sorted(self.fuzzy_score_map.items())).encode('utf-8'))
+        key_hash.update(repr((self.py_initial_fuzzy_map, self.py_final_fuzzy_map, self.py_full_fuzzy_map)).encode('utf-8'))
+
+        dict_files = [(hf_dict, 'hf_dict_utf8.txt'), (py_dict, 'pinyin_list.txt'),
+                      (filter_dict, 'dict_filter_rule.txt'), (custom_dict or None, 'dict_custom.txt')]
+        for dict_file, default_name in dict_files:
+            if dict_file is None:
+                key_hash.update(b'|none')
+            else:
+                key_hash.update(b'|' + self.resolve_dict_path(dict_file, default_name).read_bytes())
 
-            self.jump_table[k] = copy.deepcopy(cur_entry)
+        if type(extra_dict) in [list, tuple]:
+            key_hash.update(('|' + '\n'.join(extra_dict)).encode('utf-8'))
+
+        return key_hash.hexdigest()
+
+    # index is a folder, python objects are pickled, tail matrices are raw npy files which can be memory-mapped
+    def get_index_dir(self, index_cache, index_key):
+        return Path(index_cache) / f"corrector_v{INDEX_FORMAT_VERSION}_{index_key}"
+
+    # load index built by a previous run, return False if not available
+    def load_index(self, index_cache, index_key):
+        if index_cache is None:
+            return False
+
+        index_dir = self.get_index_dir(index_cache, index_key)
+        if not index_dir.is_dir():
+            return False
+
+        try:
+            with open(str(index_dir / 'index.pkl'), mode='rb') as index_f:
+                state = pickle.load(index_f)
+
+            tail_codes, tail_codes_special = self.load_tail_codes(index_dir)
+        except Exception as e:  # broken file, just rebuild
+            print(f"WARNING: failed to load index {index_dir}: {e}")
+            return False
+
+        if state.get('version') != INDEX_FORMAT_VERSION or state.get('key') != index_key:
+            return False
+
+        self.med_names = state['med_names']
+        self.med_py_list = state['med_py_list']
+        self.filter_pre_dict = state['filter_pre_dict']
+        self.filter_dict = state['filter_dict']
+        self.hf_symptom = state['hf_symptom']
+        self.hf_examination = state['hf_examination']
+        self.hf_medicine = state['hf_medicine']
+        self.char_py_table = state['char_py_table']
+
+        self.jump_table = JumpTable.from_state(self.py_ids, self.score_levels, state['jump_table'], tail_codes)
+        self.jump_table_special = JumpTable.from_state(self.py_ids, self.score_levels, state['jump_table_special'],
+                                                       tail_codes_special)
+
+        # mark as recently used, so clean_index_cache keeps it
+        try:
+            os.utime(str(index_dir))
+        except OSError:
+            pass
+
+        return True
+
+    # save built index, written to temp file first so concurrent workers never see partial file
+    def save_index(self, index_cache, index_key):
+        if index_cache is None:
+            return
 
-        # build special index
-        for k, v in self.all_pinyin.items():
-            cur_entry = JumpTableEntry(len(self.med_py_list))
+        state = {'version': INDEX_FORMAT_VERSION,
+                 'key': index_key,
+                 'med_names': self.med_names,
+                 'med_py_list': self.med_py_list,
+                 'filter_pre_dict': self.filter_pre_dict,
+                 'filter_dict': self.filter_dict,
+                 'hf_symptom': self.hf_symptom,
+                 'hf_examination': self.hf_examination,
+                 'hf_medicine': self.hf_medicine,
+                 'char_py_table': self.char_py_table,
+                 'jump_table': self.jump_table.get_state(),
+                 'jump_table_special': self.jump_table_special.get_state()
+                 }
+
+        index_dir = self.get_index_dir(index_cache, index_key)
+        tmp_dir = index_dir.with_name(f"{index_dir.name}.{os.getpid()}.tmp")
+        try:
+            tmp_dir.mkdir(parents=True, exist_ok=True)
+            with open(str(tmp_dir / 'index.pkl'), mode='wb') as index_f:
+                pickle.dump(state, index_f, protocol=pickle.HIGHEST_PROTOCOL)
+            np.save(str(tmp_dir / 'tail.npy'), self.jump_table.tail_codes)
+            np.save(str(tmp_dir / 'tail_special.npy'), self.jump_table_special.tail_codes)
+
+            os.replace(str(tmp_dir), str(index_dir))
+        except OSError as e:  # cache is optional, read-only deployments still work, or other worker saved first
+            shutil.rmtree(str(tmp_dir), ignore_errors=True)
+            if not index_dir.is_dir():
+                print(f"WARNING: failed to save index {index_dir}: {e}")
+                return
+
+        self.clean_index_cache(index_cache, index_dir)
+
+        # switch to the saved file, so the builder shares the same pages as processes loading it later
+        if self.share_index:
+            self.jump_table.tail_codes, self.jump_table_special.tail_codes = self.load_tail_codes(index_dir)
+
+    # every change of dicts or thresholds (and each hot reload after one) saves a new index dir,
+    # keep the INDEX_CACHE_KEEP most recently saved or loaded ones, older ones are removed with their lock files
+    # an index locked by another process (building or loading it) is kept, mapped files of a removed one stay valid
+    def clean_index_cache(self, index_cache, index_dir):
+        try:
+            index_dirs = [(d.stat().st_mtime, d) for d in Path(index_cache).glob('corrector_v*')
+                          if d.is_dir() and not d.name.endswith('.tmp')]
+        except OSError:  # removed by another process meanwhile, clean next time
+            return
 
-            for item_id, item in enumerate(self.med_py_list):
-                py_list = item[self.special_pinyin_col] # special
-                l = item[self.special_pinyin_len_col]
+        index_dirs.sort(key=lambda x: x[0], reverse=True)
+        for _, old_dir in index_dirs[INDEX_CACHE_KEEP:]:
+            if old_dir == index_dir:
+                continue
 
-                for i in range(l):
-                    # need to process multiple case
-                    score = 0.0
-                    for py, py_part in py_list[i].items():
-                        cur_score = self.get_single_match_score(k, v, py, py_part)
-                        score = max(score, cur_score)
+            lock_path = old_dir.with_name(f"{old_dir.name}.lock")
+            try:
+                with open(str(lock_path), mode='a') as lock_f:
+                    fcntl.flock(lock_f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    shutil.rmtree(str(old_dir), ignore_errors=True)
+                    os.remove(str(lock_path))
+            except OSError:  # in use or already removed
+                continue
 
-                    if i == 0:  # start ch
-                        if score >= self.start_th:
-                            cur_entry.head_table.append((item_id, score))
-                    else:
-                        cur_entry.tail_table[item_id].append(score)
+    # in shared mode tail matrices are read-only mappings of index file, pages are shared by all processes
+    def load_tail_codes(self, index_dir):
+        mmap_mode = 'r' if self.share_index else None
+
+        return (np.load(str(index_dir / 'tail.npy'), mmap_mode=mmap_mode),
+                np.load(str(index_dir / 'tail_special.npy'), mmap_mode=mmap_mode))
+
+    # exclusive file lock for building one index, no-op if cache is disabled or not writable
+    @contextmanager
+    def lock_index(self, index_cache, index_key):
+        lock_f = None
+        if index_cache is not None:
+            index_dir = self.get_index_dir(index_cache, index_key)
+            try:
+                index_dir.parent.mkdir(parents=True, exist_ok=True)
+                lock_f = open(str(index_dir.with_name(f"{index_dir.name}.lock")), mode='a')
+            except OSError:
+                lock_f = None
+
+        if lock_f is None:
+            yield
+            return
 
-            self.jump_table_special[k] = copy.deepcopy(cur_entry)
+        with lock_f:
+            fcntl.flock(lock_f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_f, fcntl.LOCK_UN)
 
     # v0 version, exhaustive search with no early stop
     def asr_correct_text_v0(self, text):
@@ -480,6 +998,8 @@ class ASR_Corrector(object):
         match_list = []
 
         for med_item in self.med_py_list:  # loop for each pre-defined medical entity
+            if med_item[0] in self.removed_items:
+                continue
             item_py = med_item[1]
             item_len = med_item[2]
 
@@ -578,18 +1098,10 @@ class ASR_Corrector(object):
 
     # check table to get match score for current pinyin and the character of item_id at pos
     def get_item_rest_match_score(self, ch_py, item_id, pos):
-        result_score = 0
-
         if pos < 1:
             return 0
 
-        for k, v in ch_py.items():
-            if k in self.jump_table:
-                tail_list = self.jump_table[k].tail_table
-
-                result_score = max(result_score, tail_list[item_id][pos - 1])
-
-        return result_score
+        return self.jump_table.get_tail_score(ch_py, item_id, pos)
 
         # when confirmed match, we calculate the actual score
     def finish_match_score(self, match_status, text):
@@ -612,29 +1124,21 @@ class ASR_Corrector(object):
 
     # check match with special index
     def get_item_rest_match_score_special(self, ch_py, item_id, pos):
-        result_score = 0
-
         if pos < 1:
             return 0
 
-        for k, v in ch_py.items():
-            if k in self.jump_table:
-                tail_list = self.jump_table_special[k].tail_table
-
-                result_score = max(result_score, tail_list[item_id][pos - 1])
+        return self.jump_table_special.get_tail_score(ch_py, item_id, pos)
 
-        return result_score
-
-    # finish score special version
-    def finish_match_score_special(self, match_status, text):
-        pos = match_status.cur_pos + 1
-        limit = match_status.item_len
-        result_score = match_status.sum_score
+    # finish score special version, candidate passed at cur_pos, tail scores from the table it started in
+    def finish_match_score_special(self, table, item_id, item_len, text_start_pos, cur_pos, sum_score, text):
+        pos = cur_pos + 1
+        limit = item_len
+        result_score = sum_score
 
         while pos < limit:
-            text_pos = match_status.text_start_pos + pos
+            text_pos = text_start_pos + pos
 
-            cur_score = self.get_item_rest_match_score_special(text[text_pos], match_status.item_id, pos)
+            cur_score = table.get_tail_score(text[text_pos], item_id, pos)
 
             result_score += cur_score
 
@@ -649,11 +1153,8 @@ class ASR_Corrector(object):
         # remove punctuations, reduce erroneous punctuation placement
         text = text.translate(self.cn_remove_table)
 
-        # apply predefined bad case saving, only for small data
-        for k, v in self.replace_list:
-            text = text.replace(k, v)
-
-        return text
+        # apply predefined bad case saving
+        return self.text_replacer.replace(text)
 
     # main API for correction, v1 version, with no special character handling
     def asr_correct_text_v1(self, text):
@@ -681,7 +1182,7 @@ class ASR_Corrector(object):
             score_map = {}
             for k, v in ch_py.items():
                 if k in self.jump_table:
-                    head_list = self.jump_table[k].head_table
+                    head_list = self.jump_table.get_head_table(k)
 
                     for item_id, score in head_list:
                         if item_id in score_map:
@@ -738,16 +1239,52 @@ class ASR_Corrector(object):
     def get_score_threshold(self, l):
         return self.avg_th * l / self.score_adjust(l)
 
-    # get single pinyin match score with cached results, avoiding repeat calculations
+    # collect statistics of asr_correct_text / asr_correct_batch calls, off by default
+    # hook(text, stats) is called after every call with its own CorrectionStats (texts list for batch)
+    def enable_stats(self, enabled=True, hook=None):
+        self.stats_enabled = enabled
+        self.stats_hook = hook
+
+    def record_stats(self, text, stats):
+        with self.stats_lock:
+            self.total_stats.add(stats)
+
+        if self.stats_hook is not None:
+            self.stats_hook(text, stats)
+
+    # aggregated statistics since last reset
+    def get_stats(self):
+        with self.stats_lock:
+            return self.total_stats.to_dict()
+
+    def reset_stats(self):
+        with self.stats_lock:
+            self.total_stats = CorrectionStats()
+
+    # size and hit counts of pinyin caches, both bounded
+    def get_cache_stats(self):
+        return {name: cache.cache_info()._asdict()
+                for name, cache in (('word_py', self.word_py_cache), ('odd_score', self.odd_score_cache))}
+
+    # get single pinyin match score, standard pinyins are looked up in precomputed sim matrix
+    # other pairs are computed and kept in a bounded cache, use_cache=False always computes
     def get_single_match_score(self, py_full_1, py_tuple_1, py_full_2, py_tuple_2, use_cache=True):
-        cache_key_1, cache_key_2 = '', ''
-        if use_cache is True:
-            cache_key_1 = f"{py_full_1}_{py_full_2}"
-            cache_key_2 = f"{py_full_2}_{py_full_1}"
+        if use_cache is not True:
+            return self.compute_single_match_score(py_full_1, py_tuple_1, py_full_2, py_tuple_2)
+
+        py_id_1 = self.py_ids.get(py_full_1)
+        py_id_2 = self.py_ids.get(py_full_2)
+        if py_id_1 is not None and py_id_2 is not None:
+            return self.score_levels[self.sim_codes[py_id_1, py_id_2]]
 
-            if cache_key_1 in self.sim_score_cache:
-                return self.sim_score_cache[cache_key_1]
+        # score is symmetric, one cache entry for both orders
+        if (py_full_2, py_tuple_2) < (py_full_1, py_tuple_1):
+            py_full_1, py_tuple_1, py_full_2, py_tuple_2 = py_full_2, py_tuple_2, py_full_1, py_tuple_1
 
+        return self.odd_score_cache(py_full_1, py_tuple_1, py_full_2, py_tuple_2)
+
+    # compute single pinyin match score from fuzzy rules
+    def compute_single_match_score(self, py_full_1, py_tuple_1, py_full_2, py_tuple_2):
         py_full_match_status = self.get_py_part_match_status(self.py_full_fuzzy_map, py_full_1, py_full_2)
 
         final_score = -1.0
@@ -759,11 +1296,6 @@ class ASR_Corrector(object):
 
             final_score = self.fuzzy_score_map[py_tuple_match_status]
 
-        if use_cache is True:
-            # update cache
-            self.sim_score_cache[cache_key_1] = final_score
-            self.sim_score_cache[cache_key_2] = final_score
-
         return final_score
 
     # get match scores for different situations
@@ -872,6 +1404,9 @@ class ASR_Corrector(object):
 
     # main API for correction,v2 version, advanced version with special character handling
     def asr_correct_text(self, text):
+        stats = CorrectionStats() if self.stats_enabled else None
+        if stats is not None:
+            phase_start = time.perf_counter()
 
         text_r = self.preprocess_text(text)
 
@@ -881,28 +1416,47 @@ class ASR_Corrector(object):
         text_py_r = self.get_item_py(text_r, heteronym=True)
         text_len_r = len(text_py_r)
 
-        text, text_py = self.handle_item_special_py(text_r, text_py_r)
+        text_s, text_py = self.handle_item_special_py(text_r, text_py_r)
         text_len = len(text_py)
 
         #print(text_py)
 
-        match_status_list = []
+        if stats is not None:
+            stats.phase_time['prepare'] = time.perf_counter() - phase_start
+            phase_start = time.perf_counter()
+
+        # candidates are kept in parallel lists instead of MatchStatus objects, current pos is i - start,
+        # so besides the score nothing changes while advancing:
+        # c_col + i is the column in tail_codes, c_end - i the count of pinyins left after current one
+        table = self.jump_table_special
+        tail_offsets = table.get_batch_arrays()[3]
+        tail_codes = np.asarray(table.tail_codes)  # plain view, indexing a memmap wraps every result
+        score_levels, full_match = self.score_levels, self.py_full_match
+        c_item, c_start, c_col, c_end, c_score, c_th = [], [], [], [], [], []
+        th_map = {}
+
         final_matches = []
+        started = pruned = 0
 
         # loop through each pinyin in text
         for i, ch_py in enumerate(text_py):
-            # process existing matches
-            for pos, match_item in enumerate(match_status_list):
-                match_item.cur_pos += 1
-                cur_score = self.get_item_rest_match_score_special(ch_py, match_item.item_id, match_item.cur_pos)
-
-                match_item.sum_score += cur_score
+            # process existing matches, best tail score among all pinyins of the character
+            readings = [table.py_ids[k] for k in ch_py if k in table.py_ids] if c_item else []
+            if readings:
+                if len(c_item) >= BULK_ADVANCE_MIN:
+                    cols = np.array(c_col) + i
+                    codes = tail_codes[np.array(readings)[:, None], cols[None, :]].max(axis=0)
+                    c_score = [score + add for score, add in zip(c_score, self.score_values[codes].tolist())]
+                else:
+                    rows = [tail_codes[r] for r in readings]
+                    c_score = [score + score_levels[max(row[col + i] for row in rows)]
+                               for score, col in zip(c_score, c_col)]
 
             # process start match
             score_map = {}
             for k, v in ch_py.items():
-                if k in self.jump_table:
-                    head_list = self.jump_table_special[k].head_table
+                if k in table:
+                    head_list = table.get_head_table(k)
 
                     for item_id, score in head_list:
                         if item_id in score_map:
@@ -910,152 +1464,297 @@ class ASR_Corrector(object):
                         else:
                             score_map[item_id] = score
 
-            # add all head status
+            # add all head status, except those pruned right after start even with full match on the rest pinyins
             for m_id, m_score in score_map.items():
                 item_len = self.med_py_list[m_id][5] # item special length
                 if i + item_len <= text_len:  # possible to get full item match
-                    cur_status = MatchStatus(m_id, self.med_py_list[m_id][3], item_len, i, m_score, self.get_score_threshold(item_len),
-                                             self.py_full_match)
+                    if item_len not in th_map:
+                        th_map[item_len] = self.get_score_threshold(item_len)
+                    if m_score + max(0, item_len - 1) * full_match < th_map[item_len]:
+                        continue
+
+                    c_item.append(m_id)
+                    c_start.append(i)
+                    c_col.append(int(tail_offsets[m_id]) - 1 - i)
+                    c_end.append(i + item_len - 1)
+                    c_score.append(m_score)
+                    c_th.append(th_map[item_len])
+                    started += 1
+
+            # check stop criterion, with many candidates skip it when none of them stops
+            limit = len(c_item)
+            if limit >= BULK_ADVANCE_MIN:
+                scores, ths = np.array(c_score), np.array(c_th)
+                if not ((scores >= ths) | (scores + np.maximum(0, np.array(c_end) - i) * full_match < ths)).any():
+                    continue
 
-                    match_status_list.append(cur_status)
-
-            # check stop criterion
             pos = 0
-            limit = len(match_status_list)
             while pos < limit:
-                cur_match_status = match_status_list[pos]
-                is_pass, is_prune = cur_match_status.check_stop()
+                sum_score, score_th = c_score[pos], c_th[pos]
 
-                if is_pass:
-                    final_score = self.finish_match_score_special(cur_match_status, text_py)
+                if sum_score >= score_th:
+                    m_id, start = c_item[pos], c_start[pos]
+                    final_score = self.finish_match_score_special(table, m_id, c_end[pos] - start + 1, start, i - start,
+                                                                  sum_score, text_py)
 
-                    final_matches.append((self.med_py_list[cur_match_status.item_id][3], # special
-                                          cur_match_status.text_start_pos,
+                    final_matches.append((self.med_py_list[m_id][3], # special
+                                          start,
                                           final_score))
-
-                if is_pass or is_prune:  # do remove, use last element to fill in and pop last
-                    match_status_list[pos] = match_status_list[-1]
-                    match_status_list.pop()
-
-                    limit -= 1
+                elif sum_score + max(0, c_end[pos] - i) * full_match < score_th:
+                    pruned += 1
                 else:
                     pos += 1
+                    continue
 
-        # post process, filter inappropriate matches, such as exact same match and matches that have range conflicts
-        result = text
-        if final_matches:  # not empty
-            final_matches = self.filter_match_special(final_matches, text)  # postpone sort
-
-            result = self.apply_correction_use_match(text, final_matches)
-
-        # since we introduce place holder, we need to remove them in any cases
-        result, final_matches = self.adjust_result_special(result, final_matches)
-
-        return result, final_matches
-
-
-def test_corrector(corrector, text):
-    print(text)
+                # do remove, use last element to fill in and pop last
+                for values in (c_item, c_start, c_col, c_end, c_score, c_th):
+                    values[pos] = values[-1]
+                    values.pop()
 
-    start = time.perf_counter()
-    corrected = corrector.asr_correct_text_v0(text)
-    duration_ms_old = (time.perf_counter() - start) * 1000
-    print(f"--- v0 method --- {corrected}")
-    print(f"used {duration_ms_old} ms")
+                limit -= 1
 
-    start = time.perf_counter()
-    corrected = corrector.asr_correct_text_v1(text)
-    duration_ms = (time.perf_counter() - start) * 1000
-    print(f"--- v1 method --- {corrected}")
-    print(f"used {duration_ms} ms")
-    print(f"improve ratio {duration_ms_old / duration_ms} ms")
+        if stats is None:
+            return self.apply_correction_special(text_s, final_matches)
 
-    start = time.perf_counter()
-    corrected = corrector.asr_correct_text(text)
-    duration_ms_new = (time.perf_counter() - start) * 1000
-    print(f"--- v2 method --- {corrected}")
-    print(f"used {duration_ms_new} ms")
-    print(f"use extra {duration_ms_new - duration_ms} ms")
+        stats.phase_time['match'] = time.perf_counter() - phase_start
+        phase_start = time.perf_counter()
+        stats.calls, stats.started, stats.pruned, stats.passed = 1, started, pruned, len(final_matches)
 
-    print()
+        result = self.apply_correction_special(text_s, final_matches, stats)
 
-def test():
-    # normal test
-    start = time.perf_counter()
-    asr_corrector_normal = ASR_Corrector(extra_dict=['酵素W', 'X精华', '妖妖零', '118', '119'])
-    print(f"index used {(time.perf_counter() - start) * 1000} ms")
+        stats.phase_time['post'] = time.perf_counter() - phase_start
+        # hook gets the text as passed in by the caller, not the preprocessed one
+        self.record_stats(text, stats)
 
-    print('--------------------------------------------------')
-    print('Normal correction tests')
-    print('--------------------------------------------------')
+        return result
 
-    simple_str = '我今天吃了一天被拉土的'
-    test_corrector(asr_corrector_normal, simple_str)
-
-    simple_str = '我吃了诺心拖一片美洛托尔名片'
-    test_corrector(asr_corrector_normal, simple_str)
-
-    simple_str = '我今天吃了一天没错罗尔'
-    test_corrector(asr_corrector_normal, simple_str)
-
-    simple_str = '我今天吃了头孢两片落心托两片'
-    test_corrector(asr_corrector_normal, simple_str)
-
-    simple_str = '我今天吃了头孢一片若心坨两片'
-    test_corrector(asr_corrector_normal, simple_str)
-
-    simple_str = '我今天吃了头孢一片若心托五片'
-    test_corrector(asr_corrector_normal, simple_str)
-
-    simple_str = '我今天吃了一片贝，那普利。我今天，吃了；一天没错、罗尔。一天被？拉土的！'
-    test_corrector(asr_corrector_normal, simple_str)
-
-    simple_str = '我吃了一片酵素打不溜还有艾克斯精华，以及R V A，闹心腿'
-    test_corrector(asr_corrector_normal, simple_str)
-
-    simple_str = '我吃了一片酵素卡托品品我要吃RV A闹心腿110数值： 1 9    3    .25'
-    test_corrector(asr_corrector_normal, simple_str)
-
-    simple_str = '高压么么久滴呀，么么吧。'
-    test_corrector(asr_corrector_normal, simple_str)
-
-    simple_str = '我吃了ABCDEFGHIJKLMNOPQRSTUVWXYZ0.123456789'
-    test_corrector(asr_corrector_normal, simple_str)
-
-    print()
-
-    # fuzzy test
-    # start = time.perf_counter()
-    # asr_corrector_fuzzy = ASR_Corrector(fuzzy_level=ASR_Corrector_FuzzyLevel.MoreFuzzy, extra_dict=['酵素W', 'X因子'])
-    # print(f"index used {(time.perf_counter() - start) * 1000} ms")
-    #
-    # print('--------------------------------------------------')
-    # print('Fuzzy correction')
-    # print('--------------------------------------------------')
-    #
-    # fuzzy_str = '我今天吃了头孢一片若心托八片'
-    # test_corrector(asr_corrector_fuzzy, fuzzy_str)
-    #
-    # fuzzy_str = '我今天吃了一片闹心腿'
-    # test_corrector(asr_corrector_fuzzy, fuzzy_str)
-
-    # stat test
-    start = time.perf_counter()
-    asr_corrector_stat = ASR_Corrector(fuzzy_level=ASR_Corrector_FuzzyLevel.MoreStrict, hf_dict=None, rep_rule=None,
-                                       filter_dict=None, custom_dict=DICT_STAT)
-    asr_corrector_stat.avg_th=0.78
-    print(f"index used {(time.perf_counter() - start) * 1000} ms")
-
-    print('--------------------------------------------------')
-    print('Stat correction')
-    print('--------------------------------------------------')
+    # post process, filter inappropriate matches, such as exact same match and matches that have range conflicts
+    def apply_correction_special(self, text, final_matches, stats=None):
+        result = text
+        if final_matches:  # not empty
+            found = len(final_matches)
+            final_matches = self.filter_match_special(final_matches, text)  # postpone sort
+            if stats is not None:
+                stats.filtered += found - len(final_matches)
 
-    stat_str = '我今天体重二百五十二磅'
-    test_corrector(asr_corrector_stat, stat_str)
+            result = self.apply_correction_use_match(text, final_matches)
 
-    stat_str = '其实宫颈心率每分钟乞食高压么么久滴呀么么吧'#'其实宫颈心率每分钟乞食高压么么久滴呀么么吧'
-    test_corrector(asr_corrector_stat, stat_str)
-
-if __name__ == '__main__':
-    test()
-    pass
+        # since we introduce place holder, we need to remove them in any cases
+        return self.adjust_result_special(result, final_matches)
+
+    # batch API for correction, gives the same (result, matches) as asr_correct_text for each text
+    # all candidates of a chunk of texts are scored together with array operations on the special jump table
+    def asr_correct_batch(self, texts, chunk_size=512):
+        # per item constants, computed on every call since avg_th may be tuned at runtime
+        item_lens = [item[self.special_pinyin_len_col] for item in self.med_py_list]
+        score_th = np.array([self.get_score_threshold(l) for l in item_lens], dtype=np.float64)
+        score_ratio = np.array([self.score_adjust(l) / l for l in item_lens], dtype=np.float64)
+
+        # same transcript only need to be corrected once
+        corrected = {}
+        unique_texts = list(dict.fromkeys(texts))
+        stats = CorrectionStats() if self.stats_enabled else None
+        for chunk_st in range(0, len(unique_texts), chunk_size):
+            chunk = unique_texts[chunk_st:chunk_st + chunk_size]
+            phase_start = time.perf_counter()
+
+            prepared = []
+            for text in chunk:
+                text_r = self.preprocess_text(text)
+                text_py_r = self.get_item_py(text_r, heteronym=True)
+                prepared.append(self.handle_item_special_py(text_r, text_py_r))
+
+            if stats is not None:
+                stats.phase_time['prepare'] += time.perf_counter() - phase_start
+                phase_start = time.perf_counter()
+
+            chunk_matches = self.match_batch_special([text_py for _, text_py in prepared], score_th, score_ratio,
+                                                     stats)
+
+            if stats is not None:
+                stats.phase_time['match'] += time.perf_counter() - phase_start
+                phase_start = time.perf_counter()
+
+            for text, (text_s, _), final_matches in zip(chunk, prepared, chunk_matches):
+                corrected[text] = self.apply_correction_special(text_s, final_matches, stats)
+
+            if stats is not None:
+                stats.phase_time['post'] += time.perf_counter() - phase_start
+
+        # whole batch is reported as one record, calls counts distinct texts
+        if stats is not None:
+            stats.calls = len(unique_texts)
+            self.record_stats(texts, stats)
+
+        return [(corrected[text][0], list(corrected[text][1])) for text in texts]
+
+    # find all passed matches of several texts, return match list (special name, start, score) for each text
+    # candidates are scored over the whole item, pass and prune are decided the same way as the single text loop
+    def match_batch_special(self, text_py_list, score_th, score_ratio, stats=None):
+        table = self.jump_table_special
+        py_num = len(table.py_ids)
+        item_num = len(score_th)  # items added by add_item after thresholds were computed are skipped
+        head_ptr, head_items, head_scores, tail_offsets = table.get_batch_arrays()
+        score_levels = np.array(table.score_levels, dtype=np.float64)
+
+        # flatten all texts, each position keeps ids of all its pinyins, padding with py_num
+        pos_py_ids = []
+        text_starts = []
+        text_ends = []
+        for text_py in text_py_list:
+            text_starts.append(len(pos_py_ids))
+            for ch_py in text_py:
+                pos_py_ids.append([table.py_ids[k] for k in ch_py if k in table.py_ids])
+            text_ends.extend([len(pos_py_ids)] * len(text_py))
+
+        results = [[] for _ in text_py_list]
+        if not pos_py_ids or item_num == 0:
+            return results
+
+        width = max(1, max(len(py_ids) for py_ids in pos_py_ids))
+        pos_readings = np.full((len(pos_py_ids), width), py_num, dtype=np.int32)
+        for pos, py_ids in enumerate(pos_py_ids):
+            pos_readings[pos, :len(py_ids)] = py_ids
+        text_ends = np.array(text_ends, dtype=np.int64)
+
+        # expand head tables of every pinyin at every position into candidates
+        read_pos, read_col = np.nonzero(pos_readings < py_num)
+        read_py = pos_readings[read_pos, read_col]
+        counts = head_ptr[read_py + 1] - head_ptr[read_py]
+        total = int(counts.sum())
+        if total == 0:
+            return results
+
+        entry = np.arange(total) + np.repeat(head_ptr[read_py] - (np.cumsum(counts) - counts), counts)
+        cand_pos = np.repeat(read_pos.astype(np.int64), counts)
+        cand_item = head_items[entry]
+        cand_score = head_scores[entry]
+        known = cand_item < item_num
+        cand_pos, cand_item, cand_score = cand_pos[known], cand_item[known], cand_score[known]
+        total = len(cand_item)
+
+        # one candidate for each (position, item), keeping the best score among pinyins of the character,
+        # ordered by first appearance, which is the order the single text loop appends candidates in
+        cand_key = cand_pos * item_num + cand_item
+        order = np.argsort(cand_key, kind='stable')
+        group_st = np.nonzero(np.concatenate([[True], cand_key[order][1:] != cand_key[order][:-1]]))[0]
+        best_score = np.maximum.reduceat(cand_score[order], group_st)
+        first = order[group_st]
+        rank = np.argsort(first, kind='stable')
+        cand_pos, cand_item, cand_score = cand_pos[first][rank], cand_item[first][rank], best_score[rank]
+
+        # possible to get full item match, and not pruned right after start even with full match on the rest pinyins
+        cand_len = np.diff(tail_offsets)[cand_item] + 1
+        keep = cand_pos + cand_len <= text_ends[cand_pos]
+        keep &= cand_score + np.maximum(0, cand_len - 1) * self.py_full_match >= score_th[cand_item]
+        cand_pos, cand_item, cand_score, cand_len = cand_pos[keep], cand_item[keep], cand_score[keep], cand_len[keep]
+        if len(cand_pos) == 0:
+            return results
+
+        # gather tail scores of all candidates, (candidate, item pos) matrix with zero beyond item length
+        tail_pos = np.arange(1, int(cand_len.max()))
+        valid = tail_pos[None, :] < cand_len[:, None]
+        text_pos = np.where(valid, cand_pos[:, None] + tail_pos[None, :], 0)
+        tail_col = np.where(valid, tail_offsets[cand_item][:, None] + tail_pos[None, :] - 1, 0)
+
+        readings = pos_readings[text_pos]
+        codes = table.tail_codes[np.minimum(readings, py_num - 1), tail_col[:, :, None]]
+        codes = np.where((readings < py_num) & valid[:, :, None], codes, 0).max(axis=2)
+
+        # accumulate in the same order as the single text loop, so scores are exactly the same
+        sum_scores = np.cumsum(np.concatenate([cand_score[:, None], score_levels[codes]], axis=1), axis=1)
+        final_scores = sum_scores[:, -1] * score_ratio[cand_item]
+
+        # replay check_stop of the single text loop at each item pos: pass is checked first,
+        # a candidate passes if it reaches the threshold before it is pruned (one of them happens at the last pos)
+        cand_th = score_th[cand_item][:, None]
+        item_pos = np.arange(sum_scores.shape[1])
+        in_item = item_pos[None, :] < cand_len[:, None]
+        pass_at = in_item & (sum_scores >= cand_th)
+        prune_at = in_item & ~pass_at & \
+            (sum_scores + np.maximum(0, cand_len[:, None] - item_pos[None, :] - 1) * self.py_full_match < cand_th)
+        first_pass = np.where(pass_at.any(axis=1), np.argmax(pass_at, axis=1), sum_scores.shape[1])
+        first_prune = np.where(prune_at.any(axis=1), np.argmax(prune_at, axis=1), sum_scores.shape[1])
+
+        is_pass = first_pass < first_prune
+        passed = np.nonzero(is_pass)[0]
+        if stats is not None:
+            stats.started += len(cand_pos)
+            stats.passed += len(passed)
+            stats.pruned += len(cand_pos) - len(passed)
+
+        # report in the same order as the single text loop, filter_match_special keeps the first one of ties:
+        # by the position a match passes at, only matches passing at the same position with the same score and
+        # name length (ties of filter_match_special) need a replay of the candidate list
+        stop_pos = cand_pos + np.minimum(first_pass, first_prune)
+        report_pos = stop_pos[passed]
+        report_rank = np.zeros(len(passed), dtype=np.int64)
+        tie_keys = Counter(zip(report_pos.tolist(), final_scores[passed].tolist(),
+                               [len(self.med_py_list[item_id][3]) for item_id in cand_item[passed].tolist()]))
+        shared_pos = np.array(sorted({key[0] for key, count in tie_keys.items() if count > 1}), dtype=np.int64)
+        if len(shared_pos):
+            text_starts_arr = np.array(text_starts + [len(pos_py_ids)], dtype=np.int64)
+            shared_ids = np.searchsorted(text_starts_arr, shared_pos, side='right') - 1
+            pass_rank = np.full(len(cand_pos), -1, dtype=np.int64)
+            pass_rank[passed] = np.arange(len(passed))
+            for text_id in np.unique(shared_ids).tolist():
+                # candidates are in append order, so those of one text are one slice
+                st, ed = np.searchsorted(cand_pos, text_starts_arr[text_id:text_id + 2])
+                until = int(shared_pos[shared_ids == text_id].max())
+                ranks = self.replay_report_order(cand_pos[st:ed], stop_pos[st:ed], is_pass[st:ed], until)
+                for cand, r in ranks.items():
+                    report_rank[pass_rank[st + cand]] = r
+        passed = passed[np.lexsort((report_rank, report_pos))]
+
+        text_starts = np.array(text_starts, dtype=np.int64)
+        text_ids = np.searchsorted(text_starts, cand_pos[passed], side='right') - 1
+
+        for text_id, pos, item_id, score in zip(text_ids.tolist(), cand_pos[passed].tolist(),
+                                                cand_item[passed].tolist(), final_scores[passed].tolist()):
+            results[text_id].append((self.med_py_list[item_id][3], pos - int(text_starts[text_id]), score))
+
+        return results
+
+    # replay the candidate list of the single text loop up to position until: candidates are appended in order,
+    # at each position the list is scanned from the front and a stopped candidate is replaced by the last one,
+    # returns report rank of passed candidates, candidates are given by start pos, stop pos and pass flag (arrays)
+    @staticmethod
+    def replay_report_order(starts, stops, passes, until):
+        order = np.argsort(stops, kind='stable')
+        order = order[stops[order] <= until]
+        group_ed = np.append(np.nonzero(np.diff(stops[order]))[0] + 1, len(order))
+        group_st = np.append(0, group_ed[:-1])
+        append_ed = np.searchsorted(starts, stops[order[group_st]], side='right')
+
+        cands = np.zeros(len(starts), dtype=np.int64)  # the list, its first size entries are in use
+        index_of = np.zeros(len(starts), dtype=np.int64)
+        reported = []
+        size = appended = 0
+        for st, ed, append_to in zip(group_st.tolist(), group_ed.tolist(), append_ed.tolist()):
+            new = append_to - appended
+            cands[size:size + new] = np.arange(appended, append_to)
+            index_of[appended:append_to] = np.arange(size, size + new)
+            size, appended = size + new, append_to
+
+            # scan of stopped slots s_1 < s_2 < ..., kept slots k_1 > k_2 > ... counted from the end:
+            # at step j slot s_j is reported, then the stopped ones after k_j from the end, then k_j fills s_j,
+            # a stopped slot reached from the end before its step (more than j - 1 kept slots after it) goes there
+            stop_slots = np.sort(index_of[order[st:ed]])
+            is_stop = np.zeros(size, dtype=bool)
+            is_stop[stop_slots] = True
+            keep_slots = np.nonzero(~is_stop)[0]
+            front_step = np.arange(1, len(stop_slots) + 1)
+            back_step = len(keep_slots) - np.searchsorted(keep_slots, stop_slots, side='right') + 1
+            from_front = front_step <= back_step
+            report = np.lexsort((np.where(from_front, 0, -stop_slots), ~from_front,
+                                 np.where(from_front, front_step, back_step)))
+            reported.extend(cands[stop_slots[report]].tolist())
+
+            keep_slots = keep_slots[::-1][:len(stop_slots)]
+            filled = stop_slots[:len(keep_slots)][stop_slots[:len(keep_slots)] < keep_slots]
+            cands[filled] = cands[keep_slots[:len(filled)]]
+            index_of[cands[filled]] = filled
+            size -= len(stop_slots)
+
+        reported = [cand for cand in reported if passes[cand]]
+        return {cand: rank for rank, cand in enumerate(reported)}
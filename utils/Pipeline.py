@@ -0,0 +1,249 @@
+# ========================================================
+#   Copyright (C) 2018 All rights reserved.
+#
+#   filename : Pipeline.py
+#   date     : 2026-10-18
+#   desc     : 识别文本的处理流程：拼音纠正 -> 切词 -> 规则提取，
+#              同步、异步服务共用
+# ========================================================
+
+import os, sys, copy, glob, time, queue, hashlib, traceback, multiprocessing
+
+# for import purpose
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from instance import *
+from utils.Cache import TTLCache
+from utils.Timing import timed
+from utils.Exrsp import *
+from utils.Logger import logger
+from utils.Modify import ASR_Corrector, ASR_Corrector_FuzzyLevel
+from utils.Rule import Rule
+
+
+# 字典版本，由规则、切词、纠错字典的内容计算，字典文件修改后版本随之改变
+def get_dict_version():
+    dict_files = [DICT_MED, DICT_PY, DICT_SEG, DICT_PRE_RULE, DICT_CUSTOM, DICT_FILTER_RULE, DICT_STAT] + \
+                 sorted(glob.glob(os.path.join(DIR_RULE, '*.txt')))
+
+    version_hash = hashlib.sha1()
+    for dict_file in dict_files:
+        version_hash.update(dict_file.encode('utf-8'))
+        if os.path.isfile(dict_file):
+            with open(dict_file, mode='rb') as dict_f:
+                version_hash.update(dict_f.read())
+
+    return version_hash.hexdigest()[:12]
+
+
+class TextPipeline(object):
+    def __init__(self, rule, asr_corrector, memo_size=TEXT_MEMO_SIZE):
+        self.rule = rule
+        self.asr_corrector = asr_corrector
+
+        # 常见回答（“高压一百二低压八十”）直接返回之前的结果，键中带字典版本，字典更新后自动失效
+        self.dict_version = get_dict_version()
+        self.memo = TTLCache(memo_size)
+
+    # timer：可选的StageTimer，记录纠正、切词、规则提取耗时
+    def run(self, info, situation, timer=None):
+        memo_key = (info, situation, self.dict_version)
+        resSets = self.memo.get(memo_key)
+        if resSets is None:
+            resSets = self.process(info, situation, timer)
+            self.memo.put(memo_key, resSets)
+
+        # 调用方可能修改结果，返回副本
+        return copy.deepcopy(resSets)
+
+    # 结果缓存的大小与命中、未命中、淘汰次数，由 /metrics 导出
+    def cache_stats(self):
+        return self.memo.stats()
+
+    # 批量处理 [(info, situation), ...]，纠正、切词一次完成，单条出错不影响其他条目
+    def run_batch(self, items):
+        results = [self.memo.get((info, situation, self.dict_version)) for info, situation in items]
+        todo = [i for i, resSets in enumerate(results) if resSets is None]
+
+        # 拼音纠正，整批出错时逐条纠正，只有出错的条目返回错误
+        correct_ids = [i for i in todo if items[i][1] != '3']
+        corr_map = {}
+        try:
+            corrected = self.asr_corrector.asr_correct_batch([items[i][0] for i in correct_ids])
+            corr_map = {i: corr for i, (corr, _) in zip(correct_ids, corrected)}
+        except Exception:
+            logger.error("[Pipeline Error] batch correct failed, retry one by one {}".format(
+                traceback.format_exc().replace("\n", "\t")))
+            for i in correct_ids:
+                try:
+                    corr_map[i], _ = self.asr_corrector.asr_correct_text(items[i][0])
+                except Exception:
+                    results[i] = self.item_error(items[i])
+        todo = [i for i in todo if results[i] is None]
+
+        # 批量切词，出错时同样逐条切词
+        corrs = [corr_map.get(i, items[i][0]) for i in todo]
+        try:
+            texts = self.rule.WordSegBatch(corrs)
+        except Exception:
+            logger.error("[Pipeline Error] batch seg failed, retry one by one {}".format(
+                traceback.format_exc().replace("\n", "\t")))
+            texts = []
+            for i, corr in zip(todo, corrs):
+                try:
+                    texts.append(self.rule.WordSeg(corr))
+                except Exception:
+                    results[i] = self.item_error(items[i])
+                    texts.append(None)
+
+        for i, corr, text in zip(todo, corrs, texts):
+            if results[i] is not None:
+                continue
+
+            info, situation = items[i]
+            try:
+                results[i] = self.structure(info, corr, situation, text)
+                self.memo.put((info, situation, self.dict_version), results[i])
+            except Exception:
+                results[i] = self.item_error(items[i])
+
+        return [copy.deepcopy(resSets) for resSets in results]
+
+    # 单条出错的返回结果
+    def item_error(self, item):
+        logger.error("[Pipeline Error] txt: {} situation: {} {}".format(
+            item[0], item[1], traceback.format_exc().replace("\n", "\t")))
+        return UnknownAudioError(None, "Pipeline", item, None)
+
+    def process(self, info, situation, timer=None):
+        # 拼音纠正
+        with timed(timer, 'correct'):
+            if situation != '3':
+                corr, _ = self.asr_corrector.asr_correct_text(info)
+            else:
+                corr = info
+
+        # 切词
+        with timed(timer, 'seg'):
+            text = self.rule.WordSeg(corr)
+
+        with timed(timer, 'judge'):
+            return self.structure(info, corr, situation, text)
+
+    def close(self):
+        self.rule.CloseSegPool()
+
+    # 规则提取
+    def structure(self, info, corr, situation, text):
+        # 修正结果
+        resSets = self.rule.JudgeType(text, situation)
+
+        resSets.update({"txt": info,
+                        "corr": corr,
+                        "seg": ' '.join(text)
+                        })
+
+        return resSets
+
+
+# 线上服务使用的处理流程：规则 + 统计字典纠错
+def build_stat_pipeline():
+    rule = Rule()
+    asr_corrector_stat = ASR_Corrector(fuzzy_level=ASR_Corrector_FuzzyLevel.MoreStrict, hf_dict=None,
+                                       rep_rule=DICT_PRE_RULE, filter_dict=None, custom_dict=DICT_STAT)
+    return TextPipeline(rule, asr_corrector_stat)
+
+
+# PIPELINE_PROCESSES>0时使用多进程处理流程
+def build_pipeline():
+    if PIPELINE_PROCESSES > 0:
+        return PipelinePool(PIPELINE_PROCESSES)
+    return build_stat_pipeline()
+
+
+# 子进程中的处理流程，每个子进程只构建一次（改错索引从INDEX_CACHE_DIR加载）
+_worker_pipeline = None
+
+
+# 构建失败时不抛出异常（进程池会不断重启子进程），把错误交给主进程
+def _init_pipeline_worker(factory, ready_queue):
+    global _worker_pipeline
+    try:
+        _worker_pipeline = factory()
+    except Exception:
+        ready_queue.put((os.getpid(), traceback.format_exc()))
+        return
+
+    ready_queue.put((os.getpid(), None))
+
+
+# 结果随带子进程的结果缓存统计，主进程汇总后导出
+def _pipeline_worker_run(info, situation):
+    return _worker_pipeline.run(info, situation), os.getpid(), _worker_pipeline.cache_stats()
+
+
+def _pipeline_worker_run_batch(items):
+    return _worker_pipeline.run_batch(items), os.getpid(), _worker_pipeline.cache_stats()
+
+
+class PipelinePool(object):
+    """
+    多进程处理流程，接口与TextPipeline相同
+    纠错、切词、JudgeType均为CPU密集的纯Python代码，线程中执行会被GIL串行化；
+    每个子进程持有自己的TextPipeline，单个服务实例可以用满所有核
+    """
+
+    def __init__(self, processes, factory=build_stat_pipeline, timeout=PIPELINE_TIMEOUT,
+                 start_timeout=PIPELINE_START_TIMEOUT):
+        # 进程池的子进程是daemon进程，不能再创建切词进程池
+        if SEG_PROCESSES > 1:
+            raise ValueError("[PipelinePool] SEG_PROCESSES > 1 cannot be used with PIPELINE_PROCESSES > 0")
+
+        self.processes = processes
+        self.timeout = timeout
+        self.worker_cache_stats = {}  # pid -> 该子进程最近一次返回的结果缓存统计
+
+        # 子进程启动时构建处理流程，全部就绪后才返回，第一个请求不承担加载时间
+        # 任一子进程构建失败或超时未就绪时关闭进程池并抛出异常，由LazyEngine记录为加载失败
+        ready_queue = multiprocessing.Queue()
+        self.pool = multiprocessing.Pool(processes, initializer=_init_pipeline_worker,
+                                         initargs=(factory, ready_queue))
+        deadline = time.time() + start_timeout
+        for _ in range(processes):
+            try:
+                pid, error = ready_queue.get(timeout=max(0, deadline - time.time()))
+            except queue.Empty:
+                self.pool.terminate()
+                raise RuntimeError("[PipelinePool] workers not ready in {}s".format(start_timeout))
+
+            if error is not None:
+                self.pool.terminate()
+                raise RuntimeError("[PipelinePool] worker {} start failed {}".format(pid, error))
+            logger.info("[PipelinePool] worker {} ready".format(pid))
+
+    # 子进程中各阶段耗时不回传，调用方只记录整体耗时
+    def run(self, info, situation, timer=None):
+        resSets, pid, stats = self.pool.apply_async(_pipeline_worker_run, (info, situation)).get(self.timeout)
+        self.worker_cache_stats[pid] = stats
+        return resSets
+
+    # 批量请求按子进程数分块，各块的纠正、切词在子进程内批量完成
+    def run_batch(self, items):
+        chunk_size = -(-len(items) // self.processes) if items else 1
+        chunks = [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+        results = []
+        for chunk_results, pid, stats in self.pool.map(_pipeline_worker_run_batch, chunks):
+            self.worker_cache_stats[pid] = stats
+            results.extend(chunk_results)
+        return results
+
+    # 各子进程结果缓存统计之和，只包含处理过请求的子进程
+    def cache_stats(self):
+        total = {'size': 0, 'maxsize': 0, 'hits': 0, 'misses': 0, 'evictions': 0}
+        for stats in list(self.worker_cache_stats.values()):
+            for key in total:
+                total[key] += stats[key]
+        return total
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
@@ -8,6 +8,8 @@
 # ======================================================== 
 
 import time, sys, os, json
+import queue, threading
+from contextlib import contextmanager
 from tencentcloud.common import credential
 from tencentcloud.common.profile.client_profile import ClientProfile
 from tencentcloud.common.profile.http_profile import HttpProfile
@@ -31,6 +33,12 @@ class ASRServerError(Exception):
         self.status = status
 
 
+# 一句话识别请求参数
+def sentence_params(data):
+    return {"ProjectId": 0, "SubServiceType": 2, "EngSerViceType": "16k", "SourceType": 1, "VoiceFormat": "mp3",
+            "UsrAudioKey": "session-123", "Data": str(base64.b64encode(data), 'utf-8'), "DataLen": len(data)}
+
+
 class BaseASR(object):
     ext2idx = {'mp3': '1', 'wav': '2'}
 
@@ -40,45 +48,88 @@ class BaseASR(object):
         self.app_key = app_key
 
     def stt(self, audio_file):
+        with open(audio_file, mode='rb') as fwave:
+            return self.stt_data(fwave.read())
+
+    # 识别内存中的音频数据
+    def stt_data(self, data):
         raise Exception("Unimplemented!")
 
 
 class BasicCloudASR(BaseASR):
     """ Online ASR from Tencent
     https://ai.qq.com/doc/aaiasr.shtml
+
+    客户端在引擎内复用，每个客户端保持一条长连接；最多创建pool_size个，
+    并发请求超过pool_size时等待空闲客户端。scheme='http'可指向本地模拟服务测试
     """
 
-    def __init__(self, api_url, app_id, app_key):
+    def __init__(self, api_url, app_id, app_key, region=CLOUD_REGION, pool_size=CLOUD_POOL_SIZE,
+                 keep_alive=CLOUD_KEEP_ALIVE, timeout=CLOUD_TIMEOUT, scheme='https'):
         super(BasicCloudASR, self).__init__(api_url, app_id, app_key)
-
-    def stt(self, audio_file):
+        self.region = region
+        self.pool_size = pool_size
+        self.keep_alive = keep_alive
+        self.timeout = timeout
+        self.scheme = scheme
+
+        self.cred = credential.Credential(self.app_id, self.app_key)
+
+        # 后进先出，优先使用刚归还的客户端，其连接最可能仍然有效
+        self.client_pool = queue.LifoQueue()
+        self.client_num = 0
+        self.pool_lock = threading.Lock()
+
+    def create_client(self):
+        httpProfile = HttpProfile(protocol=self.scheme, endpoint=self.api_url,
+                                  reqTimeout=self.timeout, keepAlive=self.keep_alive)
+
+        clientProfile = ClientProfile()
+        clientProfile.httpProfile = httpProfile
+
+        return asr_client.AsrClient(self.cred, self.region, clientProfile)
+
+    # 从连接池借出客户端，用完归还
+    @contextmanager
+    def get_client(self):
+        try:
+            client = self.client_pool.get_nowait()
+        except queue.Empty:
+            with self.pool_lock:
+                can_create = self.client_num < self.pool_size
+                if can_create:
+                    self.client_num += 1
+
+            if can_create:
+                try:
+                    client = self.create_client()
+                except:
+                    # 创建失败时归还名额，否则等待中的请求会一直阻塞
+                    with self.pool_lock:
+                        self.client_num -= 1
+                    raise
+            else:
+                client = self.client_pool.get()
+
+        try:
+            yield client
+        finally:
+            self.client_pool.put(client)
+
+    def stt_data(self, data):
         try :
-            fwave = open(audio_file, mode='rb')
-            data = fwave.read()
-            dataLen = len(data)
-            base64Wav = base64.b64encode(data)
-            fwave.close()
-
-
-            params = '{"ProjectId":0,"SubServiceType":2,"EngSerViceType":"16k","SourceType":1,"VoiceFormat":"mp3","UsrAudioKey":"session-123", ' + '"Data":"' + str(base64Wav, 'utf-8') + '", "DataLen":' + str(dataLen) + '}'
-
-            cred = credential.Credential(self.app_id, self.app_key)
-            httpProfile = HttpProfile()
-            httpProfile.endpoint = self.api_url
-
-            clientProfile = ClientProfile()
-            clientProfile.httpProfile = httpProfile
-            client = asr_client.AsrClient(cred, "ap-chengdu", clientProfile)
+            params = json.dumps(sentence_params(data))
 
             req = models.SentenceRecognitionRequest()
 
             req.from_json_string(params)
-            res = client.SentenceRecognition(req)
+            with self.get_client() as client:
+                res = client.SentenceRecognition(req)
             resp = json.loads(res.to_json_string())
 
             return resp['Result']
         except TencentCloudSDKException as err:
-            ASRServerError(err, "404")
+            raise ASRServerError(err.get_message(), err.get_code())
 
 
 
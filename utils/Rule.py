@@ -11,12 +11,28 @@ from utils.Chinese_to_arabic import *
 from utils.Exrsp import *
 import pkuseg
 import os
+import threading
+import multiprocessing
+from itertools import chain
 from utils.Logger import logger
 import re
 
 from instance.Variable import *
 
 
+# 批量切词子进程中的切词模型，每个子进程只加载一次
+_seg_worker = None
+
+
+def _InitSegWorker(filename):
+    global _seg_worker
+    _seg_worker = pkuseg.pkuseg(model_name='medicine', user_dict=filename)
+
+
+def _SegWorkerCut(infos):
+    return [_seg_worker.cut(info) for info in infos]
+
+
 class Rule:
     """
     Rule类
@@ -24,7 +40,7 @@ class Rule:
     类函数：切词函数
     """
 
-    def __init__(self):
+    def __init__(self, seg_processes=SEG_PROCESSES):
         self.init_load()
 
         # 加载药名字典
@@ -32,6 +48,11 @@ class Rule:
         # 加载切词字典
         self.seg = self.InitPkuseg(DICT_SEG)
 
+        # 批量切词进程池，首次使用时创建
+        self.seg_processes = seg_processes
+        self.seg_pool = None
+        self.seg_pool_lock = threading.Lock()
+
     def init_load(self):
         # 加载“关键词->问题”映射词典        
         self.status = self.load_dict_file(DIR_RULE, 'ques')
@@ -73,7 +94,10 @@ class Rule:
         seg = pkuseg.pkuseg(model_name='medicine', user_dict=filename)
         return seg
 
-    def LoadDrugName(self, filename, DrugName=set()):
+    def LoadDrugName(self, filename, DrugName=None):
+        # 每次新建集合，重载字典时新旧Rule对象互不影响
+        if DrugName is None:
+            DrugName = set()
         fd = open(filename, 'r')
         for line in fd:
             line = line.strip()
@@ -87,6 +111,37 @@ class Rule:
         text = self.seg.cut(info)
         return text
 
+    # 批量切词，相同句子只切一次；
+    # 句子数不少于SEG_PARALLEL_MIN且seg_processes>1时，分块交给进程池并行切词
+    def WordSegBatch(self, infos):
+        unique_infos = list(dict.fromkeys(infos))
+
+        if self.seg_processes > 1 and len(unique_infos) >= SEG_PARALLEL_MIN:
+            pool = self.GetSegPool()
+            chunk_size = -(-len(unique_infos) // (self.seg_processes * 4))
+            chunks = [unique_infos[i:i + chunk_size] for i in range(0, len(unique_infos), chunk_size)]
+            texts = list(chain.from_iterable(pool.map(_SegWorkerCut, chunks)))
+        else:
+            texts = [self.seg.cut(info) for info in unique_infos]
+
+        seg_map = dict(zip(unique_infos, texts))
+        # 重复句子各自返回独立的列表，JudgeType可能修改切词结果
+        return [list(seg_map[info]) for info in infos]
+
+    def GetSegPool(self):
+        with self.seg_pool_lock:
+            if self.seg_pool is None:
+                self.seg_pool = multiprocessing.Pool(self.seg_processes,
+                                                     initializer=_InitSegWorker, initargs=(DICT_SEG,))
+        return self.seg_pool
+
+    def CloseSegPool(self):
+        with self.seg_pool_lock:
+            if self.seg_pool is not None:
+                self.seg_pool.close()
+                self.seg_pool.join()
+                self.seg_pool = None
+
     # 解析名字
     def _CalcName(self, wordseg, index, num, DrugList):
         key, ix, maxlen = "NULL", index - 1, len(wordseg) - 1
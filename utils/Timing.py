@@ -0,0 +1,53 @@
+# ========================================================
+#   Copyright (C) 2018 All rights reserved.
+#
+#   filename : Timing.py
+#   date     : 2026-10-18
+#   desc     : 记录单个请求各阶段耗时，以 Server-Timing 响应头返回，
+#              压测工具（tools/load_test.py）据此统计各阶段延迟
+# ========================================================
+
+import time
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
+
+
+class StageTimer(object):
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.durations = OrderedDict()  # 阶段 -> 毫秒，同一阶段多次计时累加
+
+    # 创建以来经过的时间（秒）
+    def elapsed(self):
+        return time.perf_counter() - self.start
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.durations[name] = self.durations.get(name, 0.0) + (time.perf_counter() - start) * 1000
+
+    # Server-Timing: upload;dur=1.2, asr;dur=310.5, ...
+    def server_timing(self):
+        return ', '.join('{};dur={:.2f}'.format(name, dur) for name, dur in self.durations.items())
+
+
+# timer为None时不计时，供可选计时的函数使用
+def timed(timer, name):
+    return timer.stage(name) if timer is not None else nullcontext()
+
+
+# 解析 Server-Timing 响应头，返回 {阶段: 毫秒}
+def parse_server_timing(header):
+    durations = {}
+    for metric in (header or '').split(','):
+        parts = [p.strip() for p in metric.split(';')]
+        if not parts[0]:
+            continue
+        for param in parts[1:]:
+            if param.startswith('dur='):
+                durations[parts[0]] = float(param[4:])
+
+    return durations
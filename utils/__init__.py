@@ -1,4 +1,8 @@
 # __init__.py
 from utils.Modify import ASR_Corrector, ASR_Corrector_FuzzyLevel
 from utils.Rule import Rule
-from utils.RecognizeTXY import BasicCloudASR
+from utils.RecognizeTXY import BasicCloudASR, ASRServerError
+from utils.Pipeline import TextPipeline, PipelinePool, build_stat_pipeline, build_pipeline
+from utils.Cache import TTLCache
+from utils.Engines import LazyEngine, EngineNotReadyError, DictWatcher, engines_status
+from utils.Timing import StageTimer